@@ -1,16 +1,24 @@
 import os
 import sys
-from flask import Flask, jsonify
-from src.main import main
+from flask import Flask, jsonify, request
+from src.main import main, RUN_LOCK
+from src.push import PushProcessor, decode_push_notification
+from src.run_history import RunHistory
 
 app = Flask(__name__)
 
+push_processor = PushProcessor(
+    debounce_seconds=float(os.environ.get("PUSH_DEBOUNCE_SECONDS", 5)),
+    max_delay_seconds=float(os.environ.get("PUSH_MAX_DELAY_SECONDS", 30))
+)
+
 @app.route("/", methods=["POST", "GET"])
 def run_agent():
     """Triggers the agent execution."""
     try:
         print("Received trigger request. Starting agent...")
-        result = main()
+        with RUN_LOCK:
+            result = main()
         
         if result and result.get('success'):
             return jsonify({
@@ -31,6 +39,51 @@ def run_agent():
             'message': f"Error: {e}"
         }), 500
 
+@app.route("/watch", methods=["POST"])
+def register_watch():
+    """Registers (or renews) the Gmail push watch. Watches expire after 7 days."""
+    topic = os.environ.get("PUBSUB_TOPIC")
+    if not topic:
+        return jsonify({'status': 'error', 'message': 'PUBSUB_TOPIC is not set'}), 500
+
+    response = push_processor.register_watch(topic)
+    if not response:
+        return jsonify({'status': 'error', 'message': 'Failed to register watch'}), 500
+    return jsonify({
+        'status': 'success',
+        'historyId': response['historyId'],
+        'expiration': response.get('expiration')
+    }), 200
+
+@app.route("/push", methods=["POST"])
+def receive_push():
+    """Receives Pub/Sub push notifications for new Gmail history."""
+    try:
+        notification = decode_push_notification(request.get_json(silent=True))
+    except ValueError as e:
+        print(f"Ignoring invalid push notification: {e}")
+        # Acknowledge anyway so Pub/Sub doesn't redeliver a malformed message
+        return jsonify({'status': 'ignored', 'message': str(e)}), 200
+
+    print(f"Received push notification (historyId: {notification['historyId']})")
+    push_processor.notify(notification['historyId'])
+    return jsonify({'status': 'accepted'}), 202
+
+@app.route("/runs/history", methods=["GET"])
+def run_history():
+    """Returns run percentiles over time and regressions against a rolling baseline, per run mode."""
+    try:
+        report = RunHistory().report(
+            days=request.args.get('days', 30, type=int),
+            baseline_runs=request.args.get('baseline_runs', 10, type=int),
+            tolerance=request.args.get('tolerance', 0.5, type=float),
+            mode=request.args.get('mode')
+        )
+        return jsonify(report), 200
+    except Exception as e:
+        print(f"Error reading run history: {e}")
+        return jsonify({'status': 'error', 'message': f"Error: {e}"}), 500
+
 if __name__ == "__main__":
     # Cloud Run sets PORT environment variable
     port = int(os.environ.get("PORT", 8080))
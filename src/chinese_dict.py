@@ -0,0 +1,263 @@
+import os
+import re
+import json
+import mmap
+import threading
+from array import array
+
+# CC-CEDICT line format: 傳統 传统 [chuan2 tong3] /tradition/traditional/
+CEDICT_LINE = re.compile(r'^(\S+)\s+(\S+)\s+\[([^\]]*)\]\s+/(.*)/\s*$')
+
+TONE_MARKS = {
+    'a': 'āáǎàa', 'e': 'ēéěèe', 'i': 'īíǐìi',
+    'o': 'ōóǒòo', 'u': 'ūúǔùu', 'ü': 'ǖǘǚǜü'
+}
+
+
+# Bumped whenever reading selection changes, so existing indexes are rebuilt
+INDEX_VERSION = 2
+
+# Everyday readings of common polyphonic characters (and particles), which CEDICT's
+# alphabetical order would otherwise resolve to a rarer reading
+PREFERRED_READINGS = {
+    '着': 'zhe5', '得': 'de5', '地': 'di4', '了': 'le5', '的': 'de5',
+    '行': 'xing2', '重': 'zhong4', '觉': 'jue2', '只': 'zhi3',
+    '要': 'yao4', '看': 'kan4', '说': 'shuo1', '更': 'geng4'
+}
+
+# Glosses that say nothing to a learner when the word has another reading
+MINOR_GLOSS = re.compile(r'^(surname |(old |archaic )?variant of |see )', re.IGNORECASE)
+
+
+def choose_reading(word, readings):
+    """Picks the learner-friendly (pinyin, glosses) pair among a headword's CEDICT readings.
+
+    CEDICT sorts readings alphabetically with capitalized (proper noun) readings first,
+    so the first reading is often a surname. Preferred readings win, then lowercase
+    readings with at least one meaningful gloss; surname and variant glosses are
+    dropped when others remain.
+    """
+    preferred = PREFERRED_READINGS.get(word)
+    for pinyin, glosses in readings:
+        if pinyin.lower() == preferred:
+            break
+    else:
+        candidates = [r for r in readings if not r[0][:1].isupper()] or readings
+        candidates = [r for r in candidates if any(not MINOR_GLOSS.match(g) for g in r[1])] or candidates
+        pinyin, glosses = candidates[0]
+
+    meaningful = [g for g in glosses if not MINOR_GLOSS.match(g)]
+    return pinyin, meaningful or glosses
+
+
+def numbered_to_tone_marks(syllable):
+    """Converts a numbered pinyin syllable (e.g. 'zhong1') to tone marks (e.g. 'zhōng')."""
+    match = re.match(r'^([a-zA-Zü:]+)([1-5])$', syllable)
+    if not match:
+        return syllable.replace('u:', 'ü')
+
+    letters = match.group(1).replace('u:', 'ü').replace('v', 'ü')
+    tone = int(match.group(2))
+    if tone == 5:
+        return letters
+
+    lower = letters.lower()
+    # Standard placement: a/e take the mark, 'ou' marks the o, otherwise the last vowel
+    if 'a' in lower:
+        index = lower.index('a')
+    elif 'e' in lower:
+        index = lower.index('e')
+    elif 'ou' in lower:
+        index = lower.index('o')
+    else:
+        index = max(lower.rfind(v) for v in 'iouü')
+        if index < 0:
+            return letters
+
+    marked = TONE_MARKS[lower[index]][tone - 1]
+    if letters[index].isupper():
+        marked = marked.upper()
+    return letters[:index] + marked + letters[index + 1:]
+
+
+def is_cjk(char):
+    """Checks whether a character is a CJK ideograph."""
+    return '一' <= char <= '鿿' or '㐀' <= char <= '䶿'
+
+
+class ChineseDictionary:
+    """CC-CEDICT lookups backed by a compact, memory-mapped sorted index.
+
+    The index is a UTF-8 file of `word\\tpinyin\\tenglish` lines sorted by word, built
+    once from the CEDICT source. Lookups binary-search the mapped file through an
+    array of line offsets, so the dictionary is never fully loaded into Python objects.
+    """
+
+    def __init__(self, cedict_path, index_path=None):
+        self.cedict_path = cedict_path
+        self.index_path = index_path or f'{cedict_path}.v{INDEX_VERSION}.idx'
+
+        if self._index_is_stale():
+            self._build_index()
+
+        self._file = open(self.index_path, 'rb')
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._offsets = array('L')
+        self.max_word_length = 1
+
+        position = 0
+        size = len(self._data)
+        while position < size:
+            self._offsets.append(position)
+            end = self._data.find(b'\n', position)
+            if end < 0:
+                end = size
+            word_end = self._data.find(b'\t', position, end)
+            self.max_word_length = max(self.max_word_length, len(self._data[position:word_end].decode('utf-8')))
+            position = end + 1
+
+    def _index_is_stale(self):
+        if not os.path.exists(self.index_path):
+            return True
+        return os.path.getmtime(self.index_path) < os.path.getmtime(self.cedict_path)
+
+    def _build_index(self):
+        """Parses the CEDICT source into the sorted index file (simplified headwords)."""
+        entries = {}
+        with open(self.cedict_path, encoding='utf-8') as source:
+            for line in source:
+                if line.startswith('#'):
+                    continue
+                match = CEDICT_LINE.match(line.strip())
+                if not match:
+                    continue
+                _, simplified, pinyin, definitions = match.groups()
+                entries.setdefault(simplified, []).append((pinyin, definitions.split('/')))
+
+        with open(self.index_path, 'wb') as index:
+            for word in sorted(entries, key=lambda w: w.encode('utf-8')):
+                pinyin, glosses = choose_reading(word, entries[word])
+                english = '; '.join(glosses[:3]).replace('\t', ' ')
+                index.write(f"{word}\t{pinyin}\t{english}\n".encode('utf-8'))
+        print(f"Built CC-CEDICT index with {len(entries)} entries: {self.index_path}")
+
+    def _line(self, i):
+        start = self._offsets[i]
+        end = self._data.find(b'\n', start)
+        if end < 0:
+            end = len(self._data)
+        return self._data[start:end]
+
+    def lookup(self, word):
+        """Returns (pinyin with tone marks, english) for a word, or None if not found."""
+        key = word.encode('utf-8')
+        low, high = 0, len(self._offsets)
+        while low < high:
+            mid = (low + high) // 2
+            line = self._line(mid)
+            headword = line.split(b'\t', 1)[0]
+            if headword < key:
+                low = mid + 1
+            elif headword > key:
+                high = mid
+            else:
+                _, pinyin, english = line.decode('utf-8').split('\t', 2)
+                marked = ''.join(numbered_to_tone_marks(s) for s in pinyin.split())
+                return marked, english
+        return None
+
+    def segment(self, text):
+        """Splits text into dictionary words using greedy longest match."""
+        words = []
+        i = 0
+        while i < len(text):
+            if not is_cjk(text[i]):
+                words.append(text[i])
+                i += 1
+                continue
+            for length in range(min(self.max_word_length, len(text) - i), 0, -1):
+                candidate = text[i:i + length]
+                if length == 1 or self.lookup(candidate):
+                    words.append(candidate)
+                    i += length
+                    break
+        return words
+
+    def annotate(self, sentence):
+        """Returns the sentence's pinyin with tone marks, one space-separated token per word."""
+        tokens = []
+        latin = ''
+        for word in self.segment(sentence):
+            if is_cjk(word[0]):
+                if latin:
+                    tokens.append(latin)
+                    latin = ''
+                entry = self.lookup(word)
+                tokens.append(entry[0] if entry else word)
+            elif word.isalnum():
+                # Keep numbers and Latin words, dropping punctuation
+                latin += word
+            elif latin:
+                tokens.append(latin)
+                latin = ''
+        if latin:
+            tokens.append(latin)
+        return ' '.join(tokens)
+
+    def vocabulary(self, sentence, limit=3, exclude=None):
+        """Picks up to `limit` multi-character words from the sentence with their glosses."""
+        exclude = exclude or set()
+        vocab = []
+        seen = set()
+        for word in self.segment(sentence):
+            if len(word) < 2 or not is_cjk(word[0]) or word in seen or word in exclude:
+                continue
+            seen.add(word)
+            entry = self.lookup(word)
+            if entry:
+                vocab.append({'word': word, 'pinyin': entry[0], 'english': entry[1]})
+            if len(vocab) >= limit:
+                break
+        return vocab
+
+    def close(self):
+        self._data.close()
+        self._file.close()
+
+
+class VocabularyCache:
+    """Remembers vocabulary already taught so the study corner doesn't repeat it."""
+
+    def __init__(self, path='vocab_cache.json'):
+        self.path = path
+        self.words = set()
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    self.words = set(json.load(f))
+            except (OSError, ValueError) as error:
+                print(f'Could not read vocabulary cache: {error}')
+
+    def __contains__(self, word):
+        return word in self.words
+
+    def snapshot(self):
+        """Returns a copy of the taught words."""
+        with self._lock:
+            return set(self.words)
+
+    def add(self, words):
+        with self._lock:
+            self.words.update(words)
+
+    def save(self):
+        try:
+            # Write a temp file and swap it in under the lock so concurrent saves can't interleave
+            with self._lock:
+                temp_path = self.path + '.tmp'
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    json.dump(sorted(self.words), f, ensure_ascii=False)
+                os.replace(temp_path, self.path)
+        except OSError as error:
+            print(f'Could not save vocabulary cache: {error}')
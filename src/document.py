@@ -0,0 +1,109 @@
+import re
+import base64
+from bs4 import BeautifulSoup
+
+HTML_MARKERS = ('<html', '<body', '<a ')
+
+
+def _decode_part(part):
+    """Decodes a Gmail API message part body using its declared charset."""
+    data = part.get('body', {}).get('data')
+    if not data:
+        return ''
+    raw = base64.urlsafe_b64decode(data)
+
+    content_type = next((h['value'] for h in part.get('headers', []) if h['name'].lower() == 'content-type'), '')
+    match = re.search(r'charset="?([\w.-]+)"?', content_type, re.IGNORECASE)
+    charset = match.group(1) if match else 'utf-8'
+    try:
+        return raw.decode(charset, errors='replace')
+    except LookupError:
+        return raw.decode('utf-8', errors='replace')
+
+
+class EmailDocument:
+    """Parsed view of one email, built in a single pass and shared by all consumers.
+
+    Holds the headers, the plain text body, the link table (href and anchor text)
+    from the HTML body, and the URIs from the List-Unsubscribe header. HTML is
+    parsed at most once per message.
+    """
+
+    def __init__(self, headers=None, text='', links=None):
+        self.headers = headers or {}
+        self.text = text
+        self.links = links or []
+        self.list_unsubscribe = re.findall(r'<([^>]+)>', self.header('List-Unsubscribe', ''))
+
+    def header(self, name, default=None):
+        """Looks up a header value by case-insensitive name."""
+        name = name.lower()
+        return next((value for key, value in self.headers.items() if key.lower() == name), default)
+
+    @property
+    def subject(self):
+        return self.header('Subject', 'No Subject')
+
+    @property
+    def sender(self):
+        return self.header('From', 'Unknown Sender')
+
+    @classmethod
+    def from_payload(cls, payload):
+        """Builds a document from a Gmail API message payload (format='full')."""
+        headers = {}
+        for header in payload.get('headers', []):
+            # Keep the first occurrence, matching how the top-level headers were read before
+            headers.setdefault(header['name'], header['value'])
+
+        plain_parts = []
+        html_parts = []
+
+        def walk(part):
+            if part.get('parts'):
+                for child in part['parts']:
+                    walk(child)
+                return
+            if part.get('filename'):
+                return  # attachment
+            mime_type = part.get('mimeType', '')
+            if mime_type == 'text/plain':
+                plain_parts.append(_decode_part(part))
+            elif mime_type == 'text/html':
+                html_parts.append(_decode_part(part))
+
+        if payload.get('parts'):
+            walk(payload)
+        else:
+            # Simple message: route by its MIME type, or by markup for mislabelled bodies
+            body = _decode_part(payload)
+            if payload.get('mimeType') == 'text/html' or any(marker in body.lower() for marker in HTML_MARKERS):
+                html_parts.append(body)
+            else:
+                plain_parts.append(body)
+
+        plain = ''.join(plain_parts)
+        html = ''.join(html_parts)
+
+        # Some senders put HTML in the text/plain part; keep any real HTML part alongside it
+        if plain and '<html' in plain.lower():
+            html = html + plain if html_parts else plain
+            plain = ''
+
+        text, links = cls._parse_html(html) if html else ('', [])
+        return cls(headers, plain or text, links)
+
+    @classmethod
+    def from_body(cls, body, headers=None):
+        """Builds a document from an already-extracted body string."""
+        if any(marker in body.lower() for marker in HTML_MARKERS):
+            text, links = cls._parse_html(body)
+            return cls(headers, text, links)
+        return cls(headers, body)
+
+    @staticmethod
+    def _parse_html(html):
+        """Single BeautifulSoup pass returning (text, [(href, anchor_text), ...])."""
+        soup = BeautifulSoup(html, 'html.parser')
+        links = [(a['href'], a.get_text().strip()) for a in soup.find_all('a', href=True)]
+        return soup.get_text(), links
@@ -1,12 +1,28 @@
 import base64
+import threading
 from email.mime.text import MIMEText
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from bs4 import BeautifulSoup
+from src.document import EmailDocument
+
+# Retries (with exponential backoff) for rate-limited or failed listing requests
+LIST_RETRIES = 5
 
 class GmailClient:
     def __init__(self, creds):
-        self.service = build('gmail', 'v1', credentials=creds)
+        self.creds = creds
+        # The underlying HTTP client isn't thread-safe, so each thread builds its own service
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._label_ids = {}
+        # Running totals for lightweight forwards, reported in the execution log
+        self.forward_stats = {'bytes_saved': 0, 'attachments_stripped': 0}
+
+    @property
+    def service(self):
+        if not hasattr(self._local, 'service'):
+            self._local.service = build('gmail', 'v1', credentials=self.creds)
+        return self._local.service
 
     def list_unread_messages(self, max_results=10):
         """Lists unread messages."""
@@ -19,6 +35,116 @@ class GmailClient:
             print(f'An error occurred: {error}')
             return []
     
+    def iter_messages(self, query='is:unread', page_size=100):
+        """Lazily yields messages matching a query, following nextPageToken across pages.
+
+        Rate limits (429, 403 rate limit exceeded) and 5xx errors are retried with backoff.
+        Any other error, or one that persists, is raised rather than silently ending the
+        listing partway through the backlog.
+        """
+        page_token = None
+        while True:
+            results = self.service.users().messages().list(
+                userId='me', q=query, maxResults=page_size, pageToken=page_token).execute(num_retries=LIST_RETRIES)
+
+            messages = results.get('messages', [])
+            print(f'Fetched page of {len(messages)} messages')
+            yield from messages
+
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                return
+
+    def get_message_headers(self, msg_id, header_names):
+        """Gets selected headers of a message without downloading its body."""
+        try:
+            message = self.service.users().messages().get(
+                userId='me', id=msg_id, format='metadata', metadataHeaders=header_names).execute()
+            headers = message.get('payload', {}).get('headers', [])
+            return {h['name']: h['value'] for h in headers}
+        except HttpError as error:
+            print(f'An error occurred getting headers: {error}')
+            return {}
+
+    def get_messages_headers(self, msg_ids, header_names, batch_size=50):
+        """Gets selected headers of many messages in batched requests. Returns {msg_id: headers}.
+
+        Messages whose request fails are left out, so callers should default to no headers.
+        """
+        headers_by_id = {}
+
+        def collect(request_id, response, exception):
+            if exception:
+                print(f'An error occurred getting headers for {request_id}: {exception}')
+                return
+            headers = response.get('payload', {}).get('headers', [])
+            headers_by_id[request_id] = {h['name']: h['value'] for h in headers}
+
+        msg_ids = list(dict.fromkeys(msg_ids))  # batch request ids must be unique
+        for start in range(0, len(msg_ids), batch_size):
+            batch = self.service.new_batch_http_request(callback=collect)
+            for msg_id in msg_ids[start:start + batch_size]:
+                batch.add(
+                    self.service.users().messages().get(
+                        userId='me', id=msg_id, format='metadata', metadataHeaders=header_names),
+                    request_id=msg_id)
+            try:
+                batch.execute()
+            except HttpError as error:
+                print(f'An error occurred getting headers: {error}')
+        return headers_by_id
+
+    def watch(self, topic_name, label_ids=None):
+        """Registers a Gmail push watch on a Pub/Sub topic. Returns the starting historyId."""
+        try:
+            request = {
+                'topicName': topic_name,
+                'labelIds': label_ids or ['INBOX'],
+                'labelFilterBehavior': 'include'
+            }
+            response = self.service.users().watch(userId='me', body=request).execute()
+            print(f"Watch registered (historyId: {response['historyId']}, expires: {response.get('expiration')})")
+            return response
+        except HttpError as error:
+            print(f'An error occurred registering watch: {error}')
+            return None
+
+    def list_history_messages(self, start_history_id, label_id='INBOX'):
+        """Lists unread messages added since start_history_id.
+
+        Returns (messages, latest_history_id), or (None, None) if the history id is too old
+        (404). Other errors (rate limits, server or auth errors) are raised so the caller
+        keeps its baseline.
+        """
+        messages = []
+        seen = set()
+        latest_history_id = start_history_id
+        page_token = None
+        try:
+            while True:
+                results = self.service.users().history().list(
+                    userId='me', startHistoryId=start_history_id, labelId=label_id,
+                    historyTypes=['messageAdded'], pageToken=page_token).execute()
+
+                for record in results.get('history', []):
+                    for added in record.get('messagesAdded', []):
+                        message = added.get('message', {})
+                        if message.get('id') in seen or 'UNREAD' not in message.get('labelIds', []):
+                            continue
+                        seen.add(message['id'])
+                        messages.append({'id': message['id'], 'threadId': message.get('threadId')})
+
+                latest_history_id = results.get('historyId', latest_history_id)
+                page_token = results.get('nextPageToken')
+                if not page_token:
+                    return messages, latest_history_id
+        except HttpError as error:
+            # 404 means the start history id is no longer available; caller should resync
+            if error.resp.status == 404:
+                print(f'History id {start_history_id} is no longer available: {error}')
+                return None, None
+            raise
+
     def thread_has_summary(self, thread_id, user_email):
         """Check if a thread already has a forwarded summary from the agent."""
         try:
@@ -48,42 +174,14 @@ class GmailClient:
         """Gets the content of a message."""
         try:
             message = self.service.users().messages().get(userId='me', id=msg_id).execute()
-            payload = message.get('payload', {})
-            headers = payload.get('headers', [])
-            
-            subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
-            sender = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown Sender')
-            
-            parts = payload.get('parts', [])
-            body = ""
-            
-            if not parts:
-                # Simple message
-                data = payload.get('body', {}).get('data')
-                if data:
-                    body = base64.urlsafe_b64decode(data).decode()
-            else:
-                # Multipart message
-                for part in parts:
-                    if part.get('mimeType') == 'text/plain':
-                        data = part.get('body', {}).get('data')
-                        if data:
-                            body += base64.urlsafe_b64decode(data).decode()
-                    elif part.get('mimeType') == 'text/html':
-                        # Prefer plain text, but if only HTML exists, we might want to parse it
-                        # For now, let's just append it if we don't have body yet, or ignore
-                        pass
-            
-            # If body is HTML, strip tags (simple approach)
-            if body and '<html' in body.lower():
-                soup = BeautifulSoup(body, 'html.parser')
-                body = soup.get_text()
+            document = EmailDocument.from_payload(message.get('payload', {}))
 
             return {
                 'id': msg_id,
-                'subject': subject,
-                'sender': sender,
-                'body': body
+                'subject': document.subject,
+                'sender': document.sender,
+                'body': document.text,
+                'document': document
             }
         except HttpError as error:
             print(f'An error occurred: {error}')
@@ -106,8 +204,14 @@ class GmailClient:
             return None
     
     
-    def forward_message(self, original_msg_id, to, summary_text):
-        """Forwards a message with summary prepended and original email embedded, preserving thread."""
+    def forward_message(self, original_msg_id, to, summary_text, lightweight=False,
+                        max_attachment_bytes=100 * 1024, max_inline_bytes=200 * 1024):
+        """Forwards a message with summary prepended and original email embedded, preserving thread.
+
+        In lightweight mode, attachments larger than max_attachment_bytes and inline parts
+        (e.g. images) larger than max_inline_bytes are replaced with a short placeholder
+        linking to the original message, while headers and text/html parts are kept.
+        """
         try:
             from email.mime.multipart import MIMEMultipart
             from email.mime.message import MIMEMessage
@@ -119,6 +223,16 @@ class GmailClient:
             
             # Parse the original email
             original_email = message_from_bytes(original_raw)
+
+            if lightweight:
+                stripped = self._strip_large_parts(
+                    original_email, original_msg_id, max_attachment_bytes, max_inline_bytes)
+                if stripped:
+                    saved = max(0, len(original_raw) - len(original_email.as_bytes()))
+                    with self._lock:
+                        self.forward_stats['attachments_stripped'] += stripped
+                        self.forward_stats['bytes_saved'] += saved
+                    print(f'Stripped {stripped} large part(s), saved {saved / 1024:.1f} KB')
             
             # Create the forwarding message
             msg = MIMEMultipart()
@@ -153,6 +267,49 @@ class GmailClient:
             print(f'An error occurred: {error}')
 
             return None
+
+    def _strip_large_parts(self, email_message, original_msg_id, max_attachment_bytes, max_inline_bytes):
+        """Replaces oversized attachments and inline parts with placeholders, in place.
+
+        Returns the number of parts replaced.
+        """
+        if not email_message.is_multipart():
+            return 0
+
+        original_link = f'https://mail.google.com/mail/u/0/#all/{original_msg_id}'
+        stripped = 0
+        parts = email_message.get_payload()
+
+        for index, part in enumerate(parts):
+            if part.is_multipart():
+                stripped += self._strip_large_parts(part, original_msg_id, max_attachment_bytes, max_inline_bytes)
+                continue
+
+            # Disposition decides; the filename is only a tie-breaker when there is none
+            disposition = part.get_content_disposition()
+            if disposition:
+                is_attachment = disposition == 'attachment'
+            else:
+                is_attachment = bool(part.get_filename())
+            is_body_text = part.get_content_maintype() == 'text' and not is_attachment
+            if is_body_text:
+                continue
+
+            payload = part.get_payload(decode=True) or b''
+            limit = max_attachment_bytes if is_attachment else max_inline_bytes
+            if len(payload) <= limit:
+                continue
+
+            name = part.get_filename() or part.get('Content-ID', '').strip('<>') or part.get_content_type()
+            placeholder = MIMEText(
+                f'[Removed {"attachment" if is_attachment else "inline part"}: {name} '
+                f'({len(payload) / 1024:.1f} KB). View the original message: {original_link}]',
+                'plain'
+            )
+            parts[index] = placeholder
+            stripped += 1
+
+        return stripped
             
     def mark_as_read(self, msg_id):
         """Marks a message as read."""
@@ -164,6 +321,15 @@ class GmailClient:
     
     def get_or_create_label(self, label_name):
         """Gets or creates a Gmail label by name."""
+        with self._lock:
+            if label_name in self._label_ids:
+                return self._label_ids[label_name]
+            label_id = self._get_or_create_label(label_name)
+            if label_id:
+                self._label_ids[label_name] = label_id
+            return label_id
+
+    def _get_or_create_label(self, label_name):
         try:
             # List all labels
             results = self.service.users().labels().list(userId='me').execute()
@@ -209,6 +375,32 @@ class GmailClient:
             error_section = ""
             if errors:
                 error_section = f"\n\n🚨 ERRORS:\n{errors}\n"
+
+            failures_section = ""
+            if stats.get('failures'):
+                failures_section = "\n⚠️ MESSAGE FAILURES:\n" + "\n".join(f"- {f}" for f in stats['failures']) + "\n"
+
+            gemini_section = ""
+            if stats.get('gemini'):
+                gemini = stats['gemini']
+                savings = f" (saved ${gemini['estimated_savings_usd']:.4f} via caching)" if gemini['cached_tokens'] else ""
+                gemini_section = (
+                    f"\n🤖 GEMINI USAGE:\n--------------\n"
+                    f"Calls: {gemini['calls']} (avg latency {gemini['avg_latency_seconds']}s)\n"
+                    f"Input tokens: {gemini['prompt_tokens']} ({gemini['cached_tokens']} cached)\n"
+                    f"Output tokens: {gemini['output_tokens']}\n"
+                    f"Estimated cost: ${gemini['estimated_cost_usd']:.4f}{savings}\n"
+                )
+
+            stages_section = ""
+            if stats.get('stages'):
+                stages_section = "\n⚙️ PIPELINE STAGES:\n--------------\n"
+                for name, stage in stats['stages'].items():
+                    stages_section += (
+                        f"{name}: workers={stage['workers']}, done={stage['processed']}, failed={stage['failed']}, "
+                        f"max queue={stage['max_queue_depth']}, avg queue={stage['avg_queue_depth']}, "
+                        f"utilization={stage['utilization']:.0%}\n"
+                    )
             
             body = f"""
 Gmail Agent Execution Log
@@ -224,7 +416,11 @@ Filtered (self-sent): {stats.get('self_sent', 0)}
 Filtered (purchase): {stats.get('purchase', 0)}
 Filtered (already summarized): {stats.get('already_summarized', 0)}
 Processed & forwarded: {stats.get('processed', 0)}
-{error_section}
+Deferred (time budget): {stats.get('deferred', 0)}
+Failed: {stats.get('failed', 0)}
+Attachments stripped: {stats.get('attachments_stripped', 0)}
+Forward bytes saved: {stats.get('bytes_saved', 0) / 1024:.1f} KB
+{gemini_section}{stages_section}{failures_section}{error_section}
 ========================
 
 This is an automated execution log from your Gmail Agent running on Google Cloud Run.
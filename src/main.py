@@ -1,12 +1,100 @@
 import os
 import time
+import threading
+import itertools
 from datetime import datetime
 from dotenv import load_dotenv
 from src.auth import authenticate_gmail
 from src.gmail_client import GmailClient
 from src.summarizer import EmailSummarizer
+from src.chinese_dict import ChineseDictionary, VocabularyCache
+from src.priority import PRIORITY_HEADERS, PriorityQueue, score_message
+from src.pipeline import Pipeline, Stage
+from src.run_history import RunHistory
 
-def main():
+# Serializes agent runs within the process (scheduled trigger and push notifications),
+# so two runs never race on the "already summarized" check and forward mail twice
+RUN_LOCK = threading.Lock()
+
+# Number of learning segments rendered in the Chinese study corner
+STUDY_CORNER_SEGMENTS = 4
+
+def batched(iterable, size):
+    """Yields lists of up to `size` items; a size of None yields everything as one list."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def format_summary_text(content, analysis, is_ftchinese):
+    """Builds the summary text prepended to the forwarded email."""
+    unsubscribe_section = ""
+    if analysis.get('unsubscribe_link'):
+        unsubscribe_section = f"\n\nUnsubscribe Link: {analysis['unsubscribe_link']}\n"
+
+    # Format insights section
+    insights_section = ""
+    if not is_ftchinese and analysis.get('sections') and len(analysis['sections']) > 0:
+        insights_section = "\n\nInsights:\n"
+        for section in analysis['sections']:
+            topic = section.get('topic', 'Unknown')
+            insight = section.get('insight', 'No insight provided')
+            insights_section += f"• {topic}: {insight}\n"
+
+    # Format translation section for FTChinese
+    translation_section = ""
+    if is_ftchinese and analysis.get('learning_segments'):
+        translation_section = "\n\n=== CHINESE STUDY CORNER ===\n"
+        for i, segment in enumerate(analysis['learning_segments'], 1):
+            if i > STUDY_CORNER_SEGMENTS:
+                break
+
+            translation_section += f"\n[Sentence {i}]\n"
+            translation_section += f"Original: {segment.get('original', '')}\n\n"
+            translation_section += f"Pinyin:   {segment.get('pinyin', '')}\n\n"
+            translation_section += f"English:  {segment.get('translation', '')}\n\n"
+            
+            if segment.get('vocabulary'):
+                translation_section += "Vocabulary:\n"
+                for vocab in segment['vocabulary']:
+                    translation_section += f"  • {vocab.get('word', '')}: {vocab.get('pinyin', '')} - {vocab.get('english', '')}\n"
+                translation_section += "\n"
+        translation_section += "\n=============================\n"
+
+    if is_ftchinese:
+        summary_text = f"""
+=== EMAIL SUMMARY ===
+
+Original Sender: {content['sender']}
+Subject: {content['subject']}{translation_section}
+Action Required: {'YES' if analysis.get('action_required', False) else 'NO'}
+Reason: {analysis.get('reason', 'None')}{unsubscribe_section}
+========================
+"""
+    else:
+        summary_text = f"""
+=== EMAIL SUMMARY ===
+
+Original Sender: {content['sender']}
+Subject: {content['subject']}
+
+Summary:
+{analysis.get('summary', 'No summary provided')}{insights_section}
+Action Required: {'YES' if analysis.get('action_required', False) else 'NO'}
+Reason: {analysis.get('reason', 'None')}{unsubscribe_section}
+========================
+"""
+
+    return summary_text
+
+def main(messages=None, send_log=True, stream=None):
+    """Runs the agent over unread mail, or only over `messages` when given (push mode).
+
+    With `stream` (or STREAM_BACKLOG=true), the whole unread backlog is read page by page
+    and flows through the pipeline without being held in memory.
+    """
     load_dotenv()
     
     execution_start = datetime.now()
@@ -16,7 +104,11 @@ def main():
         'self_sent': 0,
         'purchase': 0,
         'already_summarized': 0,
-        'processed': 0
+        'processed': 0,
+        'deferred': 0,
+        'failed': 0,
+        'attachments_stripped': 0,
+        'bytes_saved': 0
     }
     
     try:
@@ -32,147 +124,215 @@ def main():
         creds = authenticate_gmail()
         client = GmailClient(creds)
         
+        # Load local CC-CEDICT dictionary for the Chinese study corner, if configured
+        chinese_dictionary = None
+        vocabulary_cache = None
+        cedict_path = os.getenv("CEDICT_PATH")
+        if cedict_path and os.path.exists(cedict_path):
+            print(f"Loading CC-CEDICT dictionary from {cedict_path}...")
+            chinese_dictionary = ChineseDictionary(cedict_path)
+            vocabulary_cache = VocabularyCache(os.getenv("VOCAB_CACHE_PATH", "vocab_cache.json"))
+
+        # Lightweight forwarding replaces large attachments with placeholders
+        lightweight_forward = os.getenv("FORWARD_MODE", "full").lower() == "lightweight"
+        max_attachment_bytes = int(os.getenv("FORWARD_MAX_ATTACHMENT_KB", "100")) * 1024
+        max_inline_bytes = int(os.getenv("FORWARD_MAX_INLINE_KB", "200")) * 1024
+
         # Initialize Summarizer
-        summarizer = EmailSummarizer(api_key)
-        
-        print("Checking for unread emails...")
-        messages = client.list_unread_messages(max_results=10)
+        summarizer = EmailSummarizer(api_key, chinese_dictionary, vocabulary_cache)
         
-        if not messages:
-            print("No unread messages found.")
-            stats['total'] = 0
+        if stream is None:
+            stream = os.getenv("STREAM_BACKLOG", "false").lower() == "true"
+
+        # Prioritization happens per window of messages; streaming keeps one page in memory
+        window_size = None
+        if messages is not None:
+            # Push mode: only the messages named in the notification
+            source = messages
+        elif stream:
+            window_size = int(os.getenv("STREAM_PAGE_SIZE", "100"))
+            print("Streaming unread emails...")
+            source = client.iter_messages('is:unread', page_size=window_size)
         else:
-            print(f"Found {len(messages)} unread emails. Processing...")
-            
-            # Update statistics
-            stats['total'] = len(messages)
+            print("Checking for unread emails...")
+            source = client.list_unread_messages(max_results=10)
+
+        # Get user's email address
+        profile = client.service.users().getProfile(userId='me').execute()
+        user_email = profile['emailAddress']
+        
+        known_senders = {s.strip().lower() for s in os.getenv("KNOWN_SENDERS", "").split(',') if s.strip()}
+
+        # Optional time budget; remaining (lower-priority) messages wait for the next run
+        time_budget = float(os.getenv("RUN_TIME_BUDGET_SECONDS", "0"))
 
-            # Get user's email address
-            profile = client.service.users().getProfile(userId='me').execute()
-            user_email = profile['emailAddress']
+        stats_lock = threading.Lock()
+        failures = []
+        claimed_threads = set()
+
+        def count(key):
+            with stats_lock:
+                stats[key] += 1
+
+        def over_budget():
+            return time_budget and (datetime.now() - execution_start).total_seconds() > time_budget
+
+        def defer(item, stage_name):
+            # Messages are handed to the pipeline well ahead of the slow stages, so the
+            # budget is checked again before any costly work starts
+            count('deferred')
+            print(f"Time budget of {time_budget:.0f}s reached. Deferring {item['id']} before {stage_name}.")
+
+        def prioritized_messages():
+            for window in batched(source, window_size):
+                stats['total'] += len(window)
+                print(f"Found {len(window)} unread emails. Processing...")
+
+                # Score messages on headers only so likely-action mail is processed first;
+                # headers for the whole window come back in batched requests, not one GET each
+                queue = PriorityQueue()
+                headers_by_id = client.get_messages_headers([msg['id'] for msg in window], PRIORITY_HEADERS)
+                for msg in window:
+                    headers = headers_by_id.get(msg['id'], {})
+                    queue.push(msg, score_message(headers, user_email, known_senders))
+
+                while queue:
+                    if over_budget():
+                        with stats_lock:
+                            stats['deferred'] += len(queue)
+                        more = " (more may remain in the backlog)" if stream else ""
+                        print(f"Time budget of {time_budget:.0f}s reached. Deferring {len(queue)} lower-priority emails{more}.")
+                        return
+                    msg, priority = queue.pop()
+                    print(f"Queueing message ID: {msg['id']} (priority: {priority})")
+                    yield msg
+
+        def fetch(msg):
+            if over_budget():
+                defer(msg, 'fetch')
+                return None
+
+            content = client.get_message_content(msg['id'])
+            if not content:
+                return None
             
-            for msg in messages:
-                print(f"Processing message ID: {msg['id']}")
-                content = client.get_message_content(msg['id'])
-                
-                if not content:
-                    continue
-                
-                # Check if this thread already has a summary
-                thread_id = msg.get('threadId')
-                if thread_id and client.thread_has_summary(thread_id, user_email):
-                    stats['already_summarized'] += 1
-                    print(f"Skipping - already has summary in thread")
-                    continue
-                
-                # Filter out emails from self or agent
-                sender_email = content['sender']
-                # Extract email from "Name <email@domain.com>" format
-                if '<' in sender_email:
-                    sender_email = sender_email.split('<')[1].split('>')[0]
-                
-                # Strip any stray brackets or spaces that might remain
-                sender_email = sender_email.strip('<> ')
-                
-                if user_email.lower() in sender_email.lower():
-                    stats['self_sent'] += 1
-                    print(f"Skipping email from self: {sender_email}")
-                    continue
+            # Check if this thread already has a summary
+            thread_id = msg.get('threadId')
+            if thread_id and client.thread_has_summary(thread_id, user_email):
+                count('already_summarized')
+                print(f"Skipping - already has summary in thread")
+                return None
+            
+            # Filter out emails from self or agent
+            sender_email = content['sender']
+            # Extract email from "Name <email@domain.com>" format
+            if '<' in sender_email:
+                sender_email = sender_email.split('<')[1].split('>')[0]
+            
+            # Strip any stray brackets or spaces that might remain
+            sender_email = sender_email.strip('<> ')
+            
+            if user_email.lower() in sender_email.lower():
+                count('self_sent')
+                print(f"Skipping email from self: {sender_email}")
+                return None
+            
+            # Filter out purchase/transactional emails
+            if summarizer.is_purchase_email(content):
+                count('purchase')
+                print(f"Skipping purchase email: {content['subject']}")
+                return None
                 
-                # Filter out purchase/transactional emails
-                if summarizer.is_purchase_email(content):
-                    stats['purchase'] += 1
-                    print(f"Skipping purchase email: {content['subject']}")
-                    continue
-                    
-                print(f"Subject: {content['subject']}")
-                print(f"From: {content['sender']}")
+            print(f"Subject: {content['subject']}")
+            print(f"From: {content['sender']}")
 
-                
-                # Check if this email is from FTChinese
-                is_ftchinese = sender_email.lower().endswith("newsletter.ftchinese.com")
-                
-                # Summarize
-                analysis = summarizer.summarize(content, include_translation=is_ftchinese)
-                if is_ftchinese:
-                    print(f"Action Required: {analysis.get('action_required', False)}")
-                else:
-                    print(f"Summary: {analysis.get('summary', 'No summary provided')}")
-                    print(f"Action Required: {analysis.get('action_required', False)}")
-                
-                # Construct summary text for forwarding
-                unsubscribe_section = ""
-                if analysis.get('unsubscribe_link'):
-                    unsubscribe_section = f"\n\nUnsubscribe Link: {analysis['unsubscribe_link']}\n"
-                
-                # Format insights section
-                insights_section = ""
-                if not is_ftchinese and analysis.get('sections') and len(analysis['sections']) > 0:
-                    insights_section = "\n\nInsights:\n"
-                    for section in analysis['sections']:
-                        topic = section.get('topic', 'Unknown')
-                        insight = section.get('insight', 'No insight provided')
-                        insights_section += f"• {topic}: {insight}\n"
-                
-                # Format translation section for FTChinese
-                translation_section = ""
-                if is_ftchinese and analysis.get('learning_segments'):
-                    translation_section = "\n\n=== CHINESE STUDY CORNER ===\n"
-                    for i, segment in enumerate(analysis['learning_segments'], 1):
-                        if i == 5:
-                            break
-
-                        translation_section += f"\n[Sentence {i}]\n"
-                        translation_section += f"Original: {segment.get('original', '')}\n\n"
-                        translation_section += f"Pinyin:   {segment.get('pinyin', '')}\n\n"
-                        translation_section += f"English:  {segment.get('translation', '')}\n\n"
-                        
-                        if segment.get('vocabulary'):
-                            translation_section += "Vocabulary:\n"
-                            for vocab in segment['vocabulary']:
-                                translation_section += f"  • {vocab.get('word', '')}: {vocab.get('pinyin', '')} - {vocab.get('english', '')}\n"
-                            translation_section += "\n"
-                    translation_section += "\n=============================\n"
-
-                if is_ftchinese:
-                    summary_text = f"""
-=== EMAIL SUMMARY ===
+            # Claim the thread so concurrent fetch workers don't summarize other unread
+            # messages in it before this one's summary has been forwarded
+            if thread_id:
+                with stats_lock:
+                    already_claimed = thread_id in claimed_threads
+                    claimed_threads.add(thread_id)
+                if already_claimed:
+                    count('already_summarized')
+                    print(f"Skipping - thread already being summarized in this run")
+                    return None
 
-Original Sender: {content['sender']}
-Subject: {content['subject']}{translation_section}
-Action Required: {'YES' if analysis.get('action_required', False) else 'NO'}
-Reason: {analysis.get('reason', 'None')}{unsubscribe_section}
-========================
-"""
-                else:
-                    summary_text = f"""
-=== EMAIL SUMMARY ===
+            # Check if this email is from FTChinese
+            is_ftchinese = sender_email.lower().endswith("newsletter.ftchinese.com")
+            return {'msg': msg, 'content': content, 'is_ftchinese': is_ftchinese}
 
-Original Sender: {content['sender']}
-Subject: {content['subject']}
+        def summarize(item):
+            if over_budget():
+                defer(item['msg'], 'summarize')
+                return None
 
-Summary:
-{analysis.get('summary', 'No summary provided')}{insights_section}
-Action Required: {'YES' if analysis.get('action_required', False) else 'NO'}
-Reason: {analysis.get('reason', 'None')}{unsubscribe_section}
-========================
-"""
-                
-                # Forward the original email with summary
-                print(f"Forwarding to {user_email}...")
-                client.forward_message(msg['id'], user_email, summary_text)
-                
-                # Apply label based on action_required
-                label = 'ActionRequired' if analysis['action_required'] else 'ReadLater'
-                client.add_label(msg['id'], label)
-                
-                stats['processed'] += 1
-                
-                # Mark as read
-                # client.mark_as_read(msg['id']) # Uncomment to enable marking as read
-                print("Done.")
-                print("-" * 30)
+            content = item['content']
+            analysis = summarizer.summarize(content, include_translation=item['is_ftchinese'])
+            if item['is_ftchinese']:
+                print(f"Action Required: {analysis.get('action_required', False)}")
+            else:
+                print(f"Summary: {analysis.get('summary', 'No summary provided')}")
+                print(f"Action Required: {analysis.get('action_required', False)}")
+            item['analysis'] = analysis
+            return item
+
+        def forward(item):
+            summary_text = format_summary_text(item['content'], item['analysis'], item['is_ftchinese'])
+            
+            # Forward the original email with summary
+            print(f"Forwarding to {user_email}...")
+            forwarded = client.forward_message(
+                item['msg']['id'], user_email, summary_text,
+                lightweight=lightweight_forward,
+                max_attachment_bytes=max_attachment_bytes,
+                max_inline_bytes=max_inline_bytes
+            )
+
+            # Only vocabulary that was actually delivered counts as taught
+            if forwarded and item['is_ftchinese']:
+                summarizer.remember_vocabulary(item['analysis'], STUDY_CORNER_SEGMENTS)
+            return item
+
+        def label(item):
+            # Apply label based on action_required
+            label_name = 'ActionRequired' if item['analysis']['action_required'] else 'ReadLater'
+            client.add_label(item['msg']['id'], label_name)
+            
+            count('processed')
+            
+            # Mark as read
+            # client.mark_as_read(item['msg']['id']) # Uncomment to enable marking as read
+            print(f"Done: {item['msg']['id']}")
+            return item
+
+        def on_error(stage_name, item, error):
+            msg = item.get('msg', item)
+            with stats_lock:
+                stats['failed'] += 1
+                failures.append(f"{msg.get('id')} ({stage_name}): {error}")
+
+        # Each stage gets its own worker pool; bounded queues between them apply backpressure
+        pipeline = Pipeline(
+            [
+                Stage('fetch', fetch, workers=int(os.getenv("PIPELINE_FETCH_WORKERS", "4"))),
+                Stage('summarize', summarize, workers=int(os.getenv("PIPELINE_SUMMARIZE_WORKERS", "2"))),
+                Stage('forward', forward, workers=int(os.getenv("PIPELINE_FORWARD_WORKERS", "2"))),
+                Stage('label', label, workers=int(os.getenv("PIPELINE_LABEL_WORKERS", "1")))
+            ],
+            queue_size=int(os.getenv("PIPELINE_QUEUE_SIZE", "8")),
+            on_error=on_error
+        )
+        pipeline.run(prioritized_messages())
+        stats['stages'] = pipeline.stats()
+        stats['failures'] = failures
+
+        if stats['total'] == 0:
+            print("No unread messages found.")
         
+        stats['attachments_stripped'] = client.forward_stats['attachments_stripped']
+        stats['bytes_saved'] = client.forward_stats['bytes_saved']
+        stats['gemini'] = summarizer.usage_stats()
+
         # Print summary statistics
         print("\n" + "=" * 50)
         print("SUMMARY STATISTICS")
@@ -182,6 +342,24 @@ Reason: {analysis.get('reason', 'None')}{unsubscribe_section}
         print(f"Filtered (purchase): {stats['purchase']}")
         print(f"Filtered (already summarized): {stats['already_summarized']}")
         print(f"Processed & forwarded: {stats['processed']}")
+        print(f"Deferred (time budget): {stats['deferred']}")
+        gemini = stats['gemini']
+        print(f"Gemini calls: {gemini['calls']} (avg latency {gemini['avg_latency_seconds']}s)")
+        print(f"Gemini tokens: {gemini['prompt_tokens']} in ({gemini['cached_tokens']} cached), {gemini['output_tokens']} out")
+        savings = f" (saved ${gemini['estimated_savings_usd']:.4f} via caching)" if gemini['cached_tokens'] else ""
+        print(f"Gemini est. cost: ${gemini['estimated_cost_usd']:.4f}{savings}")
+        print(f"Failed: {stats['failed']}")
+        for failure in stats.get('failures', []):
+            print(f"  - {failure}")
+        if stats.get('stages'):
+            print("-" * 50)
+            print(f"{'Stage':<10} {'Workers':>7} {'Done':>5} {'Failed':>6} {'MaxQ':>5} {'AvgQ':>6} {'Util':>6}")
+            for name, stage in stats['stages'].items():
+                print(f"{name:<10} {stage['workers']:>7} {stage['processed']:>5} {stage['failed']:>6} "
+                      f"{stage['max_queue_depth']:>5} {stage['avg_queue_depth']:>6} {stage['utilization']:>6.0%}")
+        if lightweight_forward:
+            print(f"Attachments stripped: {stats['attachments_stripped']}")
+            print(f"Forward bytes saved: {stats['bytes_saved'] / 1024:.1f} KB")
         print("=" * 50)
         
     except Exception as e:
@@ -189,39 +367,59 @@ Reason: {analysis.get('reason', 'None')}{unsubscribe_section}
         print(f"Error during execution: {error_message}")
     
     finally:
-        # Send execution log email
-        try:
-            execution_end = datetime.now()
-            execution_time = execution_end.strftime("%Y-%m-%d %H:%M:%S")
+        # Release cached prompt contexts
+        if 'summarizer' in locals():
+            summarizer.close()
+
+        # Release the memory-mapped dictionary index
+        if locals().get('chinese_dictionary'):
+            chinese_dictionary.close()
+
+        # Send execution log email (skipped for push-triggered runs)
+        if send_log:
+            try:
+                execution_end = datetime.now()
+                execution_time = execution_end.strftime("%Y-%m-%d %H:%M:%S")
             
-            # Re-authenticate if needed for sending log
-            if 'client' not in locals():
-                creds = authenticate_gmail()
-                client = GmailClient(creds)
+                # Re-authenticate if needed for sending log
+                if 'client' not in locals():
+                    creds = authenticate_gmail()
+                    client = GmailClient(creds)
             
-            # Get user email
-            if 'user_email' not in locals():
-                profile = client.service.users().getProfile(userId='me').execute()
-                user_email = profile['emailAddress']
+                # Get user email
+                if 'user_email' not in locals():
+                    profile = client.service.users().getProfile(userId='me').execute()
+                    user_email = profile['emailAddress']
             
-            print(f"\nSending execution log to {user_email}...")
-            client.send_execution_log(
-                to=user_email,
-                stats=stats,
-                errors=error_message,
-                execution_time=execution_time
-            )
-            print("Execution log sent successfully.")
-        except Exception as log_error:
-            print(f"Failed to send execution log: {log_error}")
+                print(f"\nSending execution log to {user_email}...")
+                client.send_execution_log(
+                    to=user_email,
+                    stats=stats,
+                    errors=error_message,
+                    execution_time=execution_time
+                )
+                print("Execution log sent successfully.")
+            except Exception as log_error:
+                print(f"Failed to send execution log: {log_error}")
     
-    # Return results for caller (e.g., Cloud Run)
-    return {
+    result = {
         'success': error_message is None,
         'stats': stats,
         'error': error_message
     }
 
+    # Append this run to the local history store for trend reporting
+    duration = (datetime.now() - execution_start).total_seconds()
+    mode = 'push' if messages is not None else ('stream' if stream else 'scheduled')
+    try:
+        RunHistory().record(execution_start, duration, result, mode)
+    except Exception as e:
+        # The history store is best-effort; never fail a run that already forwarded mail
+        print(f"Could not record run history: {e}")
+
+    # Return results for caller (e.g., Cloud Run)
+    return result
+
 
 if __name__ == "__main__":
     main()
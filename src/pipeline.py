@@ -0,0 +1,135 @@
+import time
+import queue
+import threading
+import traceback
+
+# Marks the end of the stream for one worker
+_DONE = object()
+
+
+class Stage:
+    """A named pipeline step run by a pool of worker threads.
+
+    `func(item)` returns the item to pass to the next stage, or None to drop it
+    (e.g. filtered out). Exceptions are recorded and only drop the failing item.
+    """
+
+    def __init__(self, name, func, workers=1):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.max_queue_depth = 0
+        self._depth_total = 0
+        self._depth_samples = 0
+        self._finished_workers = 0
+        self._lock = threading.Lock()
+
+    def record_depth(self, depth):
+        with self._lock:
+            self.max_queue_depth = max(self.max_queue_depth, depth)
+            self._depth_total += depth
+            self._depth_samples += 1
+
+    def stats(self, wall_seconds):
+        """Returns queue depth and utilization figures for this stage."""
+        capacity = self.workers * wall_seconds
+        return {
+            'workers': self.workers,
+            'processed': self.processed,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'busy_seconds': round(self.busy_seconds, 2),
+            'max_queue_depth': self.max_queue_depth,
+            'avg_queue_depth': round(self._depth_total / self._depth_samples, 2) if self._depth_samples else 0,
+            'utilization': round(self.busy_seconds / capacity, 3) if capacity else 0
+        }
+
+
+class Pipeline:
+    """Runs items through stages connected by bounded queues.
+
+    Each stage has its own worker pool; when a downstream queue is full, upstream
+    workers block, which keeps memory bounded and the slowest stage visible.
+    """
+
+    def __init__(self, stages, queue_size=8, on_error=None):
+        self.stages = stages
+        self.queues = [queue.Queue(maxsize=max(1, int(queue_size))) for _ in stages]
+        self.on_error = on_error
+        self.wall_seconds = 0.0
+
+    def _put(self, index, item):
+        self.queues[index].put(item)
+        self.stages[index].record_depth(self.queues[index].qsize())
+
+    def _worker(self, index):
+        stage = self.stages[index]
+        inbox = self.queues[index]
+        is_last = index == len(self.stages) - 1
+
+        while True:
+            item = inbox.get()
+            if item is _DONE:
+                break
+
+            start = time.monotonic()
+            try:
+                result = stage.func(item)
+            except Exception as e:
+                result = None
+                with stage._lock:
+                    stage.failed += 1
+                print(f"[{stage.name}] Failed: {e}")
+                traceback.print_exc()
+                if self.on_error:
+                    self.on_error(stage.name, item, e)
+            else:
+                with stage._lock:
+                    if result is None:
+                        stage.dropped += 1
+                    else:
+                        stage.processed += 1
+            finally:
+                with stage._lock:
+                    stage.busy_seconds += time.monotonic() - start
+
+            if result is not None and not is_last:
+                self._put(index + 1, result)
+
+        # The last worker of a stage to finish signals the end to the next stage
+        with stage._lock:
+            stage._finished_workers += 1
+            all_finished = stage._finished_workers == stage.workers
+        if all_finished and not is_last:
+            for _ in range(self.stages[index + 1].workers):
+                self.queues[index + 1].put(_DONE)
+
+    def run(self, source):
+        """Feeds items from `source` (any iterable) through all stages and waits for completion."""
+        start = time.monotonic()
+        threads = []
+        for index, stage in enumerate(self.stages):
+            for n in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._worker, args=(index,), name=f"{stage.name}-{n}", daemon=True)
+                thread.start()
+                threads.append(thread)
+
+        try:
+            for item in source:
+                self._put(0, item)
+        finally:
+            for _ in range(self.stages[0].workers):
+                self.queues[0].put(_DONE)
+            for thread in threads:
+                thread.join()
+            self.wall_seconds = time.monotonic() - start
+
+    def stats(self):
+        """Returns per-stage statistics keyed by stage name."""
+        return {stage.name: stage.stats(self.wall_seconds) for stage in self.stages}
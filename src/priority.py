@@ -0,0 +1,95 @@
+import re
+import heapq
+import itertools
+
+# Headers needed for scoring; fetched with format='metadata' so bodies aren't downloaded
+PRIORITY_HEADERS = [
+    'From', 'To', 'Cc', 'Subject', 'In-Reply-To', 'References',
+    'List-Id', 'List-Unsubscribe', 'Precedence', 'Auto-Submitted'
+]
+
+BULK_SENDER_MARKERS = [
+    'noreply', 'no-reply', 'donotreply', 'do-not-reply', 'newsletter',
+    'notifications@', 'notification@', 'mailer@', 'marketing@', 'news@', 'updates@'
+]
+
+DEADLINE_PATTERN = re.compile(
+    r'\b(urgent|asap|deadline|due|today|tomorrow|eod|by (mon|tues|wednes|thurs|fri|satur|sun)day|'
+    r'rsvp|action required|reminder|expires?|respond|reply needed)\b',
+    re.IGNORECASE
+)
+
+
+def extract_address(value):
+    """Extracts the bare email address from a "Name <email@domain.com>" header value."""
+    if '<' in value:
+        value = value.split('<')[1].split('>')[0]
+    return value.strip('<> ').lower()
+
+
+def score_message(headers, user_email, known_senders=None):
+    """Cheap header-only score estimating how likely a message needs attention.
+
+    Higher is more important. Bulk mail (mailing lists, no-reply senders) is pushed down;
+    known human senders, direct mail, replies to the user and question/deadline subjects
+    are pushed up.
+    """
+    known_senders = known_senders or set()
+    user_email = user_email.lower()
+
+    sender = extract_address(headers.get('From', ''))
+    to = headers.get('To', '').lower()
+    cc = headers.get('Cc', '').lower()
+    subject = headers.get('Subject', '')
+    precedence = headers.get('Precedence', '').lower()
+
+    score = 0
+
+    # Bulk mail signals
+    is_bulk = (
+        headers.get('List-Id') or headers.get('List-Unsubscribe')
+        or precedence in ('bulk', 'list', 'junk')
+        or headers.get('Auto-Submitted', 'no').lower() != 'no'
+        or any(marker in sender for marker in BULK_SENDER_MARKERS)
+    )
+    if is_bulk:
+        score -= 3
+
+    # Known human senders
+    if sender in known_senders or sender.split('@')[-1] in known_senders:
+        score += 4
+
+    # Addressed directly rather than via a list or Cc
+    if user_email in to:
+        score += 2
+    elif user_email in cc:
+        score += 1
+
+    # Replies in a conversation the user is part of
+    if headers.get('In-Reply-To') or headers.get('References'):
+        score += 2
+
+    if '?' in subject:
+        score += 1
+    if DEADLINE_PATTERN.search(subject):
+        score += 2
+
+    return score
+
+
+class PriorityQueue:
+    """Max-priority queue of messages; ties keep their original (list) order."""
+
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+
+    def push(self, msg, score):
+        heapq.heappush(self._heap, (-score, next(self._counter), msg))
+
+    def pop(self):
+        neg_score, _, msg = heapq.heappop(self._heap)
+        return msg, -neg_score
+
+    def __len__(self):
+        return len(self._heap)
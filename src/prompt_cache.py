@@ -0,0 +1,166 @@
+import time
+import datetime
+import threading
+
+# Explicit context caches are rejected below this many tokens (Gemini 2.5 Flash / Flash-Lite)
+MIN_CACHE_TOKENS = 1024
+
+
+def estimate_tokens(text):
+    """Rough token estimate (~4 characters per token)."""
+    return len(text) // 4
+
+
+class GeminiCacheBackend:
+    """Registers instructions with the Gemini API as cached contents."""
+
+    def create_cached_model(self, model_name, key, instructions, ttl_seconds):
+        import google.generativeai as genai
+        from google.generativeai import caching
+
+        cached = caching.CachedContent.create(
+            model=f'models/{model_name}',
+            display_name=f'gmail-agent-{key}',
+            system_instruction=instructions,
+            ttl=datetime.timedelta(seconds=ttl_seconds)
+        )
+        return cached, genai.GenerativeModel.from_cached_content(cached_content=cached)
+
+    def system_instruction_model(self, model_name, instructions):
+        import google.generativeai as genai
+
+        return genai.GenerativeModel(model_name, system_instruction=instructions)
+
+    def refresh(self, cached, ttl_seconds):
+        cached.update(ttl=datetime.timedelta(seconds=ttl_seconds))
+
+    def delete(self, cached):
+        cached.delete()
+
+
+class _LocalUsage:
+    def __init__(self, prompt_token_count, cached_content_token_count, candidates_token_count):
+        self.prompt_token_count = prompt_token_count
+        self.cached_content_token_count = cached_content_token_count
+        self.candidates_token_count = candidates_token_count
+
+
+class _LocalResponse:
+    def __init__(self, text, usage_metadata):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+class _LocalModel:
+    def __init__(self, backend, instructions, cached):
+        self.backend = backend
+        self.instructions = instructions
+        self.cached = cached
+
+    def generate_content(self, prompt):
+        self.backend.requests.append(prompt)
+        instruction_tokens = estimate_tokens(self.instructions)
+        text = self.backend.responder(self.instructions, prompt)
+        usage = _LocalUsage(
+            prompt_token_count=instruction_tokens + estimate_tokens(prompt),
+            cached_content_token_count=instruction_tokens if self.cached else 0,
+            candidates_token_count=estimate_tokens(text)
+        )
+        return _LocalResponse(text, usage)
+
+
+class LocalCacheBackend:
+    """In-process stand-in for the Gemini cache, for tests and local runs without an API key.
+
+    Records every registration, refresh, deletion and request; answers requests with
+    `responder(instructions, prompt)`. Set `supports_caching=False` to exercise the
+    system-instruction fallback.
+    """
+
+    def __init__(self, responder=None, supports_caching=True):
+        self.responder = responder or (lambda instructions, prompt: '{"action_required": false, "reason": "Local response"}')
+        self.supports_caching = supports_caching
+        self.created = []
+        self.refreshed = []
+        self.deleted = []
+        self.requests = []
+
+    def create_cached_model(self, model_name, key, instructions, ttl_seconds):
+        if not self.supports_caching:
+            raise RuntimeError('Cached content is not supported')
+        self.created.append(key)
+        return key, _LocalModel(self, instructions, cached=True)
+
+    def system_instruction_model(self, model_name, instructions):
+        return _LocalModel(self, instructions, cached=False)
+
+    def refresh(self, cached, ttl_seconds):
+        self.refreshed.append(cached)
+
+    def delete(self, cached):
+        self.deleted.append(cached)
+
+
+class PromptCache:
+    """Registers each static instruction block once and hands out models bound to it.
+
+    Instructions of at least `min_cache_tokens` are stored as cached contents; shorter
+    ones (or ones the API rejects) are attached as a system instruction, which keeps a
+    stable prefix that Gemini's implicit caching can reuse. Cached contents are
+    extended before they expire and deleted when the run ends.
+    """
+
+    def __init__(self, model_name, ttl_seconds=3600, refresh_margin_seconds=300, backend=None,
+                 min_cache_tokens=MIN_CACHE_TOKENS):
+        self.model_name = model_name
+        self.min_cache_tokens = min_cache_tokens
+        self.ttl_seconds = ttl_seconds
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self.backend = backend or GeminiCacheBackend()
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def model_for(self, key, instructions):
+        """Returns a model with the instructions for `key` already registered."""
+        with self._lock:
+            entry = self._entries.get(key)
+            now = time.monotonic()
+
+            if entry and entry['cached'] is not None and entry['expires'] - now < self.refresh_margin_seconds:
+                try:
+                    self.backend.refresh(entry['cached'], self.ttl_seconds)
+                    entry['expires'] = now + self.ttl_seconds
+                except Exception as e:
+                    print(f"Failed to extend cached context '{key}': {e}")
+                    entry = None
+
+            if entry is None:
+                cached, model = None, None
+                if estimate_tokens(instructions) < self.min_cache_tokens:
+                    # Too small for an explicit cache; skip the API call that would be rejected
+                    print(f"Instructions for '{key}' are below the cache minimum. Using system instruction.")
+                else:
+                    try:
+                        cached, model = self.backend.create_cached_model(
+                            self.model_name, key, instructions, self.ttl_seconds)
+                        print(f"Registered cached context '{key}' (ttl: {self.ttl_seconds}s)")
+                    except Exception as e:
+                        print(f"Context caching unavailable for '{key}' ({e}). Using system instruction.")
+                if model is None:
+                    model = self.backend.system_instruction_model(self.model_name, instructions)
+                entry = {'cached': cached, 'model': model, 'expires': now + self.ttl_seconds}
+                self._entries[key] = entry
+
+            return entry['model']
+
+    def close(self):
+        """Deletes cached contents so they stop accruing storage cost."""
+        with self._lock:
+            for key, entry in self._entries.items():
+                if entry['cached'] is None:
+                    continue
+                try:
+                    self.backend.delete(entry['cached'])
+                except Exception as e:
+                    print(f"Failed to delete cached context '{key}': {e}")
+            self._entries = {}
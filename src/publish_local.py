@@ -0,0 +1,27 @@
+"""Local stand-in for Pub/Sub: posts a Gmail push notification to the running agent.
+
+Usage: python -m src.publish_local <historyId> [url]
+"""
+import sys
+import json
+import base64
+import requests
+
+def publish(history_id, url="http://localhost:8080/push", email_address="me"):
+    notification = {'emailAddress': email_address, 'historyId': int(history_id)}
+    envelope = {
+        'message': {
+            'data': base64.b64encode(json.dumps(notification).encode('utf-8')).decode('ascii'),
+            'messageId': f'local-{history_id}'
+        },
+        'subscription': 'projects/local/subscriptions/gmail-agent-push'
+    }
+    response = requests.post(url, json=envelope, timeout=10)
+    print(f"{response.status_code}: {response.text}")
+    return response
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    publish(sys.argv[1], *sys.argv[2:3])
@@ -0,0 +1,137 @@
+import os
+import json
+import time
+import base64
+import threading
+from googleapiclient.errors import HttpError
+from src.auth import authenticate_gmail
+from src.gmail_client import GmailClient
+from src.main import main, RUN_LOCK
+
+HISTORY_STATE_FILE = 'history_state.json'
+
+
+def decode_push_notification(envelope):
+    """Decodes a Pub/Sub push envelope into the Gmail notification ({emailAddress, historyId})."""
+    message = (envelope or {}).get('message', {})
+    data = message.get('data')
+    if not data:
+        raise ValueError('Push envelope has no message data')
+    notification = json.loads(base64.b64decode(data).decode('utf-8'))
+    if not isinstance(notification, dict) or 'historyId' not in notification:
+        raise ValueError('Push notification has no historyId')
+    try:
+        int(notification['historyId'])
+    except (TypeError, ValueError):
+        raise ValueError(f"Push notification has a non-numeric historyId: {notification['historyId']!r}")
+    return notification
+
+
+class PushProcessor:
+    """Debounces Gmail push notifications and processes only the messages in the history delta.
+
+    Notifications arriving in a burst are coalesced: processing starts once no new
+    notification has arrived for `debounce_seconds`, or after `max_delay_seconds` at most.
+    """
+
+    def __init__(self, debounce_seconds=5, max_delay_seconds=30, state_path=None):
+        self.debounce_seconds = debounce_seconds
+        self.max_delay_seconds = max_delay_seconds
+        # On Cloud Run, point this at a mounted volume; the container filesystem is per-instance
+        self.state_path = state_path or os.getenv('HISTORY_STATE_PATH', HISTORY_STATE_FILE)
+        self._lock = threading.Lock()
+        self._timer = None
+        self._first_pending = None
+        self._pending_history_id = None
+
+    def load_history_id(self):
+        if not os.path.exists(self.state_path):
+            return None
+        try:
+            with open(self.state_path) as f:
+                return json.load(f).get('historyId')
+        except (OSError, ValueError) as error:
+            print(f'Could not read history state: {error}')
+            return None
+
+    def save_history_id(self, history_id):
+        try:
+            # Swap in a complete file so a crash (or a network-mounted volume) never leaves half a baseline
+            temp_path = self.state_path + '.tmp'
+            with open(temp_path, 'w') as f:
+                json.dump({'historyId': str(history_id)}, f)
+            os.replace(temp_path, self.state_path)
+        except OSError as error:
+            print(f'Could not save history state: {error}')
+
+    def register_watch(self, topic_name):
+        """Registers the Gmail watch and records its historyId as the processing baseline."""
+        client = GmailClient(authenticate_gmail())
+        response = client.watch(topic_name)
+        if response:
+            self.save_history_id(response['historyId'])
+        return response
+
+    def notify(self, history_id):
+        """Records a notification and (re)starts the debounce timer."""
+        with self._lock:
+            now = time.monotonic()
+            if self._first_pending is None:
+                self._first_pending = now
+            if self._pending_history_id is None or int(history_id) > int(self._pending_history_id):
+                self._pending_history_id = str(history_id)
+
+            if self._timer:
+                self._timer.cancel()
+            remaining = self.max_delay_seconds - (now - self._first_pending)
+            delay = max(0, min(self.debounce_seconds, remaining))
+            self._timer = threading.Timer(delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """Processes the messages added since the last processed historyId."""
+        with self._lock:
+            self._timer = None
+            self._first_pending = None
+            notified_history_id = self._pending_history_id
+            self._pending_history_id = None
+
+        if notified_history_id is None:
+            return None
+
+        if not RUN_LOCK.acquire(blocking=False):
+            # A scheduled or push run is in progress; try again once it has had time to finish
+            print('Agent run already in progress. Deferring notification...')
+            self.notify(notified_history_id)
+            return None
+
+        try:
+            start_history_id = self.load_history_id()
+            if start_history_id is None:
+                print('No history baseline found. Running a full unread check...')
+                result = main()
+                self.save_history_id(notified_history_id)
+                return result
+
+            client = GmailClient(authenticate_gmail())
+            messages, latest_history_id = client.list_history_messages(start_history_id)
+            if messages is None:
+                print('History baseline expired. Running a full unread check...')
+                result = main()
+                self.save_history_id(notified_history_id)
+                return result
+
+            print(f'Push notification: {len(messages)} new unread message(s) since history {start_history_id}')
+            result = main(messages=messages, send_log=False) if messages else None
+            self.save_history_id(max(int(latest_history_id), int(notified_history_id)))
+            return result
+        except HttpError as error:
+            # Transient or auth error: keep the baseline so the next notification covers these messages
+            print(f'Error listing history, keeping baseline {start_history_id}: {error}')
+            return None
+        except Exception as e:
+            print(f'Error processing push notification: {e}')
+            return None
+        finally:
+            RUN_LOCK.release()
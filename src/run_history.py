@@ -0,0 +1,262 @@
+import os
+import sys
+import json
+import sqlite3
+import argparse
+from contextlib import closing
+from datetime import datetime, timedelta
+
+RUN_HISTORY_PATH = 'run_history.db'
+
+# How a run was started; each mode has its own trends and regression baseline
+RUN_MODES = ('scheduled', 'stream', 'push')
+
+# Metrics tracked over time: name -> (column, description)
+TREND_METRICS = {
+    'duration': ('duration_seconds', 'Run duration (s)'),
+    'gemini_latency': ('gemini_avg_latency', 'Gemini avg latency (s)'),
+    'backlog': ('total', 'Unread backlog size')
+}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))  # ceil
+    return ordered[int(rank) - 1]
+
+
+class RunHistory:
+    """Appends each run's stats to a local SQLite store and reports trends over time.
+
+    Runs are tagged with their mode (see RUN_MODES). A push run handles a few messages
+    and a scheduled run the whole inbox, so the two are never compared with each other.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv('RUN_HISTORY_PATH', RUN_HISTORY_PATH)
+        with closing(self._connect()) as conn, conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS runs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    started_at TEXT NOT NULL,
+                    mode TEXT NOT NULL DEFAULT 'scheduled',
+                    duration_seconds REAL,
+                    success INTEGER,
+                    total INTEGER,
+                    processed INTEGER,
+                    failed INTEGER,
+                    deferred INTEGER,
+                    gemini_avg_latency REAL,
+                    error TEXT,
+                    stats_json TEXT
+                )''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS run_stages (
+                    run_id INTEGER NOT NULL REFERENCES runs(id),
+                    stage TEXT NOT NULL,
+                    busy_seconds REAL,
+                    utilization REAL,
+                    max_queue_depth INTEGER,
+                    failed INTEGER
+                )''')
+            # Stores created before run modes existed get the column; their runs count as scheduled
+            columns = [row['name'] for row in conn.execute('PRAGMA table_info(runs)')]
+            if 'mode' not in columns:
+                conn.execute("ALTER TABLE runs ADD COLUMN mode TEXT NOT NULL DEFAULT 'scheduled'")
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_runs_started_at ON runs(started_at)')
+
+    def _connect(self):
+        # `with conn` only commits or rolls back; callers wrap it in closing() to release the file
+        conn = sqlite3.connect(self.path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def record(self, started_at, duration_seconds, result, mode='scheduled'):
+        """Appends one run (the dict returned by main()) to the store. Returns the run id."""
+        stats = result.get('stats', {})
+        gemini = stats.get('gemini', {})
+        try:
+            with closing(self._connect()) as conn, conn:
+                cursor = conn.execute(
+                    '''INSERT INTO runs (started_at, mode, duration_seconds, success, total, processed, failed,
+                                         deferred, gemini_avg_latency, error, stats_json)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                    (
+                        started_at.isoformat(timespec='seconds'), mode, duration_seconds,
+                        int(bool(result.get('success'))), stats.get('total', 0), stats.get('processed', 0),
+                        stats.get('failed', 0), stats.get('deferred', 0),
+                        gemini.get('avg_latency_seconds') if gemini.get('calls') else None,
+                        result.get('error'), json.dumps(stats, default=str)
+                    )
+                )
+                run_id = cursor.lastrowid
+                for name, stage in stats.get('stages', {}).items():
+                    conn.execute(
+                        'INSERT INTO run_stages VALUES (?, ?, ?, ?, ?, ?)',
+                        (run_id, name, stage.get('busy_seconds'), stage.get('utilization'),
+                         stage.get('max_queue_depth'), stage.get('failed'))
+                    )
+            return run_id
+        except sqlite3.Error as error:
+            print(f'Could not record run history: {error}')
+            return None
+
+    def runs(self, days=30, mode=None):
+        """Returns runs started in the last `days` days (optionally of one mode), oldest first."""
+        since = (datetime.now() - timedelta(days=days)).isoformat(timespec='seconds')
+        where = 'r.started_at >= ?'
+        params = [since]
+        if mode:
+            where += ' AND r.mode = ?'
+            params.append(mode)
+        with closing(self._connect()) as conn:
+            rows = conn.execute(f'SELECT * FROM runs r WHERE {where} ORDER BY r.started_at, r.id', params).fetchall()
+            stage_rows = conn.execute(
+                f'SELECT s.* FROM run_stages s JOIN runs r ON r.id = s.run_id WHERE {where}', params).fetchall()
+
+        stages = {}
+        for row in stage_rows:
+            stages.setdefault(row['run_id'], {})[row['stage']] = row['busy_seconds']
+
+        runs = []
+        for row in rows:
+            run = {key: row[key] for key in row.keys() if key != 'stats_json'}
+            run['stage_seconds'] = stages.get(row['id'], {})
+            runs.append(run)
+        return runs
+
+    def report(self, days=30, baseline_runs=10, tolerance=0.5, mode=None):
+        """Summarizes trends and flags regressions, separately for each run mode.
+
+        Percentiles (p50/p90/p99) are grouped by day. The latest run of a mode is
+        flagged as a regression for a metric when it exceeds the median of the previous
+        `baseline_runs` runs of the same mode by more than `tolerance` (0.5 = 50%).
+        Pass `mode` to report on a single mode.
+        """
+        runs = self.runs(days, mode)
+
+        by_mode = {}
+        for run in runs:
+            by_mode.setdefault(run['mode'], []).append(run)
+
+        modes = {}
+        for name in sorted(by_mode, key=lambda m: RUN_MODES.index(m) if m in RUN_MODES else len(RUN_MODES)):
+            mode_runs = by_mode[name]
+            modes[name] = {
+                'total_runs': len(mode_runs),
+                'latest_run': mode_runs[-1],
+                'trends': self._trends(mode_runs),
+                'regressions': self._regressions(mode_runs, baseline_runs, tolerance)
+            }
+
+        return {
+            'days': days,
+            'total_runs': len(runs),
+            'modes': modes
+        }
+
+    @staticmethod
+    def _trends(runs):
+        """Daily run counts, errors and p50/p90/p99 per metric."""
+        daily = {}
+        for run in runs:
+            day = daily.setdefault(run['started_at'][:10], {'runs': 0, 'errors': 0, 'values': {m: [] for m in TREND_METRICS}})
+            day['runs'] += 1
+            day['errors'] += 0 if run['success'] else 1
+            for metric, (column, _) in TREND_METRICS.items():
+                if run[column] is not None:
+                    day['values'][metric].append(run[column])
+            for stage, seconds in run['stage_seconds'].items():
+                if seconds is not None:
+                    day['values'].setdefault(f'stage_{stage}', []).append(seconds)
+
+        trends = []
+        for date, day in sorted(daily.items()):
+            entry = {'date': date, 'runs': day['runs'], 'errors': day['errors']}
+            for metric, values in day['values'].items():
+                entry[metric] = {
+                    'p50': percentile(values, 50),
+                    'p90': percentile(values, 90),
+                    'p99': percentile(values, 99)
+                } if values else None
+            trends.append(entry)
+        return trends
+
+    @staticmethod
+    def _regressions(runs, baseline_runs, tolerance):
+        """Metrics where the latest run exceeds the median of the runs before it."""
+        regressions = []
+        if len(runs) > 1:
+            latest = runs[-1]
+            previous = runs[-baseline_runs - 1:-1]
+            for metric, (column, label) in TREND_METRICS.items():
+                values = [r[column] for r in previous if r[column] is not None]
+                if len(values) < 3 or latest[column] is None:
+                    continue
+                baseline = percentile(values, 50)
+                if baseline and latest[column] > baseline * (1 + tolerance):
+                    regressions.append({
+                        'metric': metric,
+                        'label': label,
+                        'latest': latest[column],
+                        'baseline': baseline,
+                        'change': round(latest[column] / baseline - 1, 3)
+                    })
+        return regressions
+
+def print_report(report):
+    """Prints a run history report as plain text, one section per run mode."""
+    print("=" * 60)
+    print(f"RUN HISTORY (last {report['days']} days, {report['total_runs']} runs)")
+    print("=" * 60)
+
+    def fmt(value):
+        return '-' if value is None else f"{value:.1f}"
+
+    if not report['modes']:
+        print("\nNo runs recorded.")
+
+    for mode, section in report['modes'].items():
+        print(f"\n--- {mode.upper()} RUNS ({section['total_runs']}) ---")
+
+        stage_metrics = sorted({key for day in section['trends'] for key in day if key.startswith('stage_')})
+        labels = [(metric, label) for metric, (_, label) in TREND_METRICS.items()]
+        labels += [(metric, f"Stage '{metric[len('stage_'):]}' busy time (s)") for metric in stage_metrics]
+
+        for metric, label in labels:
+            print(f"\n{label}")
+            print(f"{'Date':<12} {'Runs':>5} {'p50':>8} {'p90':>8} {'p99':>8}")
+            for day in section['trends']:
+                values = day.get(metric) or {}
+                print(f"{day['date']:<12} {day['runs']:>5} {fmt(values.get('p50')):>8} "
+                      f"{fmt(values.get('p90')):>8} {fmt(values.get('p99')):>8}")
+
+        print()
+        if section['regressions']:
+            print(f"⚠️ REGRESSIONS (latest {mode} run vs. rolling baseline):")
+            for regression in section['regressions']:
+                print(f"- {regression['label']}: {regression['latest']:.1f} vs. baseline "
+                      f"{regression['baseline']:.1f} (+{regression['change']:.0%})")
+        else:
+            print(f"No {mode} regressions against the rolling baseline.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show Gmail Agent run history trends.")
+    parser.add_argument('--days', type=int, default=30, help="How many days of history to include")
+    parser.add_argument('--baseline-runs', type=int, default=10, help="Runs in the rolling baseline")
+    parser.add_argument('--tolerance', type=float, default=0.5, help="Allowed increase over baseline (0.5 = 50%%)")
+    parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+    parser.add_argument('--mode', choices=RUN_MODES, default=None, help="Only report runs of this mode")
+    parser.add_argument('--db', default=None, help="Path to the run history database")
+    args = parser.parse_args()
+
+    history = RunHistory(args.db)
+    report = history.report(args.days, args.baseline_runs, args.tolerance, args.mode)
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(report)
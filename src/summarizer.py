@@ -1,70 +1,159 @@
 import os
+import re
+import time
+import threading
 import google.generativeai as genai
 import json
+from src.document import EmailDocument
+from src.prompt_cache import PromptCache
+
+# Multilingual unsubscribe keywords (lowercased)
+UNSUBSCRIBE_KEYWORDS = [
+    'unsubscribe', 'optout', 'opt-out', 'remove', 'preferences',
+    '退订', '取消订阅',  # Chinese
+    'darse de baja', 'cancelar suscripción', # Spanish
+    'se désabonner', 'désinscription', # French
+    'abmelden', # German
+    '配信停止', '退会', # Japanese
+    '수신거부', '구독취소', # Korean
+    'annulla iscrizione', 'cancellati', # Italian
+    'cancelar subscrição', 'remover', # Portuguese
+    'отписаться', # Russian
+]
+
+UNSUBSCRIBE_URL_KEYWORDS = ['unsubscribe', 'optout', 'opt-out', 'remove']
+
+# Plain-text URL fallback; earlier keywords win when several links match
+UNSUBSCRIBE_URL_RANKING = ['unsubscribe', 'optout', 'opt-out', 'remove', 'preferences']
+UNSUBSCRIBE_URL_PATTERN = re.compile(
+    r'https?://[^\s<>"]+?(unsubscribe|optout|opt-out|remove|preferences)[^\s<>"]*', re.IGNORECASE)
+
+# Static instructions for each prompt, sent as a system instruction (or a cached context
+# once they reach the explicit-cache minimum; see PromptCache)
+TRANSLATION_LOCAL_INSTRUCTIONS = """You are an intelligent email assistant specialized in Chinese language learning. Analyze the FTChinese email provided by the user and select sentences for study.
+
+IMPORTANT: You must respond with ONLY valid JSON in this exact format (no additional text):
+{
+    "action_required": true,
+    "reason": "Brief explanation of why action is or isn't required",
+    "learning_segments": [
+        {
+            "original": "...",
+            "translation": "..."
+        }
+    ]
+}
+
+Rules:
+- action_required: true if the email requires a response or action from the recipient, false otherwise
+- reason: Brief explanation (one sentence)
+- learning_segments: The first 5 distinct sentences of the main article content, one sentence per segment, copied exactly from the email.
+- EXCLUDE any promotional content, advertisements, newsletter subscription reminders, or FTChinese membership benefits from the learning_segments.
+- For each sentence, provide ONLY the original Chinese text and the English translation.
+- Output ONLY the JSON object, nothing else
+"""
+
+TRANSLATION_INSTRUCTIONS = """You are an intelligent email assistant specialized in Chinese language learning. Analyze the FTChinese email provided by the user and provide a structured learning breakdown.
+
+IMPORTANT: You must respond with ONLY valid JSON in this exact format (no additional text):
+{
+    "action_required": true,
+    "reason": "Brief explanation of why action is or isn't required",
+    "learning_segments": [
+        {
+            "original": "...",
+            "pinyin": "...",
+            "vocabulary": [
+                {"word": "...", "pinyin": "...", "english": "..."}
+            ],
+            "translation": "..."
+        }
+    ]
+}
+
+Rules:
+- action_required: true if the email requires a response or action from the recipient, false otherwise
+- reason: Brief explanation (one sentence)
+- learning_segments: Break the email body down **sentence by sentence** for the first 5 distinct sentences of the main article content. Each segment should represent exactly one distinct sentence.
+- EXCLUDE any promotional content, advertisements, newsletter subscription reminders, or FTChinese membership benefits from the learning_segments. Focus ONLY on the first 5 sentences of the actual article or main content.
+- For each sentence in learning_segments, you MUST provide the original Chinese text, the pinyin with tone marks, a list of up to 3 key vocabulary words, and the English translation.
+- Output ONLY the JSON object, nothing else
+"""
+
+SUMMARY_INSTRUCTIONS = """You are an intelligent email assistant. Analyze the email provided by the user and provide a structured response.
+
+IMPORTANT: You must respond with ONLY valid JSON in this exact format (no additional text):
+{
+    "summary": "A concise 1-2 sentence overall summary of the email",
+    "sections": [
+        {
+            "topic": "Topic or theme of this section",
+            "insight": "Key insight, information, or takeaway from this section"
+        }
+    ],
+    "action_required": true,
+    "reason": "Brief explanation of why action is or isn't required"
+}
+
+Rules:
+- summary: Concise overall summary of the email (1-2 sentences)
+- sections: Break down the email into logical sections.
+- action_required: true if the email requires a response or action from the recipient, false otherwise
+- reason: Brief explanation (one sentence)
+- Output ONLY the JSON object, nothing else
+"""
+
 
 class EmailSummarizer:
-    def __init__(self, api_key):
+    def __init__(self, api_key, chinese_dictionary=None, vocabulary_cache=None, prompt_cache=None):
         genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-2.5-flash-lite')
+        self.model_name = 'gemini-2.5-flash-lite'
+        # Static instructions are registered once; each request carries only the email
+        self.prompt_cache = prompt_cache or PromptCache(
+            self.model_name, ttl_seconds=int(os.getenv("PROMPT_CACHE_TTL_SECONDS", "3600")))
+        self.usage = {'calls': 0, 'prompt_tokens': 0, 'cached_tokens': 0, 'output_tokens': 0, 'latency_seconds': 0.0}
+        self._usage_lock = threading.Lock()
+        # When a local dictionary is available, pinyin and vocabulary are generated
+        # locally and Gemini is only asked for sentence selection and translation
+        self.chinese_dictionary = chinese_dictionary
+        self.vocabulary_cache = vocabulary_cache
     
-    def extract_unsubscribe_link(self, email_body):
-        """Extracts unsubscribe link from email body if present."""
-        import re
-        from bs4 import BeautifulSoup
-        
-        # Multilingual unsubscribe keywords (lowercased)
-        keywords = [
-            'unsubscribe', 'optout', 'opt-out', 'remove', 'preferences',
-            '退订', '取消订阅',  # Chinese
-            'darse de baja', 'cancelar suscripción', # Spanish
-            'se désabonner', 'désinscription', # French
-            'abmelden', # German
-            '配信停止', '退会', # Japanese
-            '수신거부', '구독취소', # Korean
-            'annulla iscrizione', 'cancellati', # Italian
-            'cancelar subscrição', 'remover', # Portuguese
-            'отписаться', # Russian
-        ]
-        
-        link = None
-        
-        # 1. Try parsing as HTML with BeautifulSoup to find anchor tags
-        if '<html' in email_body.lower() or '<body' in email_body.lower() or '<a ' in email_body.lower():
-            soup = BeautifulSoup(email_body, 'html.parser')
-            for a_tag in soup.find_all('a', href=True):
-                text = a_tag.get_text().strip().lower()
-                href = a_tag['href'].lower()
-                
-                # Check if anchor text contains any keyword
-                if any(kw in text for kw in keywords):
-                    link = a_tag['href']
-                    break
-                    
-                # Check if href contains English-like keywords for URL matching
-                english_kws = ['unsubscribe', 'optout', 'opt-out', 'remove']
-                if any(kw in href for kw in english_kws):
-                    link = a_tag['href']
+    def extract_unsubscribe_link(self, document):
+        """Extracts unsubscribe link from a parsed email document (or raw body string) if present."""
+        if isinstance(document, str):
+            document = EmailDocument.from_body(document)
+
+        # 1. The List-Unsubscribe header is the most reliable source; prefer web links over mailto
+        if document.list_unsubscribe:
+            web_links = [uri for uri in document.list_unsubscribe if uri.lower().startswith('http')]
+            return (web_links or document.list_unsubscribe)[0]
+
+        # 2. Anchors from the HTML body, matched on anchor text or href
+        for href, text in document.links:
+            text = text.lower()
+            href_lower = href.lower()
+
+            # Check if anchor text contains any keyword
+            if any(kw in text for kw in UNSUBSCRIBE_KEYWORDS):
+                return href
+
+            # Check if href contains English-like keywords for URL matching
+            if any(kw in href_lower for kw in UNSUBSCRIBE_URL_KEYWORDS):
+                return href
+
+        # 3. Fallback to a single regex pass over the plain text, ranking matches by keyword
+        best_link = None
+        best_rank = len(UNSUBSCRIBE_URL_RANKING)
+        for match in UNSUBSCRIBE_URL_PATTERN.finditer(document.text):
+            rank = UNSUBSCRIBE_URL_RANKING.index(match.group(1).lower())
+            if rank < best_rank:
+                best_link, best_rank = match.group(0), rank
+                if rank == 0:
                     break
-        
-        if link:
-            return link
-
-        # 2. Fallback to regex for plain text or generic URL extraction
-        patterns = [
-            r'https?://[^\s<>"]+?unsubscribe[^\s<>"]*',
-            r'https?://[^\s<>"]+?optout[^\s<>"]*',
-            r'https?://[^\s<>"]+?opt-out[^\s<>"]*',
-            r'https?://[^\s<>"]+?remove[^\s<>"]*',
-            r'https?://[^\s<>"]+?preferences[^\s<>"]*',
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, email_body, re.IGNORECASE)
-            if match:
-                link = match.group(0)
-                # Clean up trailing punctuation or HTML artifacts
-                link = re.sub(r'[,;.)\]]+$', '', link)
-                return link
+
+        if best_link:
+            # Clean up trailing punctuation or HTML artifacts
+            return re.sub(r'[,;.)\]]+$', '', best_link)
         
         return None
     
@@ -98,78 +187,103 @@ class EmailSummarizer:
         # Filter if: (2+ keywords) OR (commerce sender + 1+ keyword)
         return keyword_count >= 2 or (is_commerce_sender and keyword_count >= 1)
 
+    def record_usage(self, response, latency):
+        """Accumulates token usage and latency from a Gemini response."""
+        usage = getattr(response, 'usage_metadata', None)
+        with self._usage_lock:
+            self.usage['calls'] += 1
+            self.usage['latency_seconds'] += latency
+            if usage:
+                self.usage['prompt_tokens'] += getattr(usage, 'prompt_token_count', 0) or 0
+                self.usage['cached_tokens'] += getattr(usage, 'cached_content_token_count', 0) or 0
+                self.usage['output_tokens'] += getattr(usage, 'candidates_token_count', 0) or 0
+
+    def usage_stats(self):
+        """Returns token, latency and estimated cost figures for the run, including cache savings."""
+        # USD per million tokens; defaults are Gemini 2.5 Flash-Lite list prices
+        input_price = float(os.getenv("GEMINI_INPUT_PRICE_PER_M", "0.10"))
+        cached_price = float(os.getenv("GEMINI_CACHED_PRICE_PER_M", "0.025"))
+        output_price = float(os.getenv("GEMINI_OUTPUT_PRICE_PER_M", "0.40"))
+
+        with self._usage_lock:
+            usage = dict(self.usage)
+
+        uncached_tokens = usage['prompt_tokens'] - usage['cached_tokens']
+        cost = (uncached_tokens * input_price + usage['cached_tokens'] * cached_price
+                + usage['output_tokens'] * output_price) / 1_000_000
+        savings = usage['cached_tokens'] * (input_price - cached_price) / 1_000_000
+
+        return {
+            'calls': usage['calls'],
+            'prompt_tokens': usage['prompt_tokens'],
+            'cached_tokens': usage['cached_tokens'],
+            'output_tokens': usage['output_tokens'],
+            'avg_latency_seconds': round(usage['latency_seconds'] / usage['calls'], 2) if usage['calls'] else 0,
+            'estimated_cost_usd': round(cost, 6),
+            'estimated_savings_usd': round(savings, 6)
+        }
+
+    def close(self):
+        """Releases cached prompt contexts at the end of the run."""
+        self.prompt_cache.close()
+
+    def annotate_segments(self, analysis):
+        """Fills in pinyin and vocabulary for learning segments using the local dictionary."""
+        if not self.chinese_dictionary:
+            return analysis
+
+        # Exclude words taught in earlier emails and words already picked for this one
+        excluded = self.vocabulary_cache.snapshot() if self.vocabulary_cache else set()
+        for segment in analysis.get('learning_segments') or []:
+            original = segment.get('original', '')
+            segment['pinyin'] = self.chinese_dictionary.annotate(original)
+
+            vocabulary = self.chinese_dictionary.vocabulary(original, limit=3, exclude=excluded)
+            segment['vocabulary'] = vocabulary
+            excluded.update(v['word'] for v in vocabulary)
+
+        return analysis
+
+    def remember_vocabulary(self, analysis, segment_count):
+        """Marks the vocabulary of the first `segment_count` segments as taught.
+
+        Call only once those segments have actually been delivered.
+        """
+        if not self.vocabulary_cache:
+            return
+
+        segments = (analysis.get('learning_segments') or [])[:segment_count]
+        self.vocabulary_cache.add(v.get('word') for s in segments for v in s.get('vocabulary') or [] if v.get('word'))
+        self.vocabulary_cache.save()
+
     def summarize(self, email_content, include_translation=False):
         """Summarizes the email and determines if action is required."""
         # Extract unsubscribe link
-        unsubscribe_link = self.extract_unsubscribe_link(email_content['body'])
+        unsubscribe_link = self.extract_unsubscribe_link(email_content.get('document') or email_content['body'])
         
-        if include_translation:
-            prompt = f"""You are an intelligent email assistant specialized in Chinese language learning. Analyze the following FTChinese email and provide a structured learning breakdown.
-
-Email Subject: {email_content['subject']}
-Email Sender: {email_content['sender']}
-Email Body:
-{email_content['body'][:4000]}
-
-IMPORTANT: You must respond with ONLY valid JSON in this exact format (no additional text):
-{{
-    "action_required": true,
-    "reason": "Brief explanation of why action is or isn't required",
-    "learning_segments": [
-        {{
-            "original": "...",
-            "pinyin": "...",
-            "vocabulary": [
-                {{"word": "...", "pinyin": "...", "english": "..."}}
-            ],
-            "translation": "..."
-        }}
-    ]
-}}
-
-Rules:
-- action_required: true if the email requires a response or action from the recipient, false otherwise
-- reason: Brief explanation (one sentence)
-- learning_segments: Break the email body down **sentence by sentence** for the first 5 distinct sentences of the main article content. Each segment should represent exactly one distinct sentence.
-- EXCLUDE any promotional content, advertisements, newsletter subscription reminders, or FTChinese membership benefits from the learning_segments. Focus ONLY on the first 5 sentences of the actual article or main content.
-- For each sentence in learning_segments, you MUST provide the original Chinese text, the pinyin with tone marks, a list of up to 3 key vocabulary words, and the English translation.
-- Output ONLY the JSON object, nothing else
-"""
+        if include_translation and self.chinese_dictionary:
+            prompt_key, instructions = 'translation_local', TRANSLATION_LOCAL_INSTRUCTIONS
+        elif include_translation:
+            prompt_key, instructions = 'translation', TRANSLATION_INSTRUCTIONS
         else:
-            prompt = f"""You are an intelligent email assistant. Analyze the following email and provide a structured response.
+            prompt_key, instructions = 'summary', SUMMARY_INSTRUCTIONS
 
-Email Subject: {email_content['subject']}
+        # Only the per-email payload goes in the prompt; the instructions are bound to the model
+        prompt = f"""Email Subject: {email_content['subject']}
 Email Sender: {email_content['sender']}
 Email Body:
 {email_content['body'][:4000]}
-
-IMPORTANT: You must respond with ONLY valid JSON in this exact format (no additional text):
-{{
-    "summary": "A concise 1-2 sentence overall summary of the email",
-    "sections": [
-        {{
-            "topic": "Topic or theme of this section",
-            "insight": "Key insight, information, or takeaway from this section"
-        }}
-    ],
-    "action_required": true,
-    "reason": "Brief explanation of why action is or isn't required"
-}}
-
-Rules:
-- summary: Concise overall summary of the email (1-2 sentences)
-- sections: Break down the email into logical sections.
-- action_required: true if the email requires a response or action from the recipient, false otherwise
-- reason: Brief explanation (one sentence)
-- Output ONLY the JSON object, nothing else
 """
+        model = self.prompt_cache.model_for(prompt_key, instructions)
         
         max_retries = 5
         retry_delay = 2
         
         for attempt in range(max_retries):
             try:
-                response = self.model.generate_content(prompt)
+                start = time.monotonic()
+                response = model.generate_content(prompt)
+                self.record_usage(response, time.monotonic() - start)
                 text = response.text.strip()
                 
                 # Attempt to extract JSON
@@ -185,6 +299,8 @@ Rules:
                 try:
                     result = json.loads(extracted_json)
                     result['unsubscribe_link'] = unsubscribe_link
+                    if include_translation:
+                        self.annotate_segments(result)
                     return result
                 except json.JSONDecodeError:
                     # 3. Fallback: regex search for JSON object
@@ -195,6 +311,8 @@ Rules:
                         try:
                             result = json.loads(json_match.group(1))
                             result['unsubscribe_link'] = unsubscribe_link
+                            if include_translation:
+                                self.annotate_segments(result)
                             return result
                         except json.JSONDecodeError:
                             pass # Continue to raise error or retry
@@ -209,7 +327,6 @@ Rules:
 
             except Exception as e:
                 import traceback
-                import time
                 
                 error_msg = str(e)
                 print(f"Attempt {attempt+1} failed: {error_msg}")
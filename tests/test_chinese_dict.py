@@ -0,0 +1,100 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from src.chinese_dict import ChineseDictionary, numbered_to_tone_marks
+
+# Readings in CEDICT order: sorted by headword and pinyin, capitalized readings first
+CEDICT_SAMPLE = """\
+# CC-CEDICT sample
+# Traditional Simplified [pinyin] /English/
+中國 中国 [Zhong1 guo2] /China/
+中文 中文 [Zhong1 wen2] /Chinese language/
+中 中 [Zhong1] /China/Chinese/surname Zhong/
+中 中 [zhong1] /within/among/in/middle/center/
+國 国 [guo2] /country/nation/state/
+地 地 [de5] /-ly/structural particle/
+地 地 [di4] /earth/ground/field/
+得 得 [de2] /to obtain/to get/
+得 得 [de5] /structural particle/
+得 得 [dei3] /to have to/must/
+着 着 [zhao1] /(chess) move/trick/
+着 着 [zhe5] /aspect particle indicating action in progress/
+學生 学生 [xue2 sheng5] /student/schoolchild/
+學 学 [xue2] /to learn/to study/
+生 生 [sheng1] /to be born/to give birth/life/
+銀行 银行 [yin2 hang2] /bank/
+行 行 [hang2] /row/line/profession/
+行 行 [xing2] /to walk/to go/capable/
+高 高 [Gao1] /surname Gao/
+高 高 [gao1] /high/tall/above average/
+丟 丢 [diu1] /to lose/to put aside/
+丟 丢 [diu1] /variant of 丟[diu1]/
+爲 为 [wei2] /variant of 為|为[wei2]/
+"""
+
+
+class ToneMarkTest(unittest.TestCase):
+    def test_marks_vowel_by_standard_placement(self):
+        self.assertEqual(numbered_to_tone_marks('zhong1'), 'zhōng')
+        self.assertEqual(numbered_to_tone_marks('hao3'), 'hǎo')
+        self.assertEqual(numbered_to_tone_marks('xie4'), 'xiè')
+        self.assertEqual(numbered_to_tone_marks('dou1'), 'dōu')
+        self.assertEqual(numbered_to_tone_marks('gui4'), 'guì')
+
+    def test_handles_umlaut_neutral_tone_and_capitals(self):
+        self.assertEqual(numbered_to_tone_marks('lu:4'), 'lǜ')
+        self.assertEqual(numbered_to_tone_marks('nv3'), 'nǚ')
+        self.assertEqual(numbered_to_tone_marks('de5'), 'de')
+        self.assertEqual(numbered_to_tone_marks('Gao1'), 'Gāo')
+
+    def test_leaves_unnumbered_syllables_alone(self):
+        self.assertEqual(numbered_to_tone_marks('r'), 'r')
+        self.assertEqual(numbered_to_tone_marks('xx5'), 'xx')
+
+
+class ChineseDictionaryTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        cedict_path = os.path.join(self.directory, 'cedict.txt')
+        with open(cedict_path, 'w', encoding='utf-8') as f:
+            f.write(CEDICT_SAMPLE)
+        self.dictionary = ChineseDictionary(cedict_path)
+
+    def tearDown(self):
+        self.dictionary.close()
+        shutil.rmtree(self.directory)
+
+    def test_segments_by_longest_match(self):
+        self.assertEqual(self.dictionary.segment('中国学生'), ['中国', '学生'])
+        self.assertEqual(self.dictionary.segment('银行A1'), ['银行', 'A', '1'])
+        # Unknown characters fall back to single-character words
+        self.assertEqual(self.dictionary.segment('中猫'), ['中', '猫'])
+
+    def test_prefers_lowercase_reading_over_proper_noun(self):
+        self.assertEqual(self.dictionary.lookup('高'), ('gāo', 'high; tall; above average'))
+        self.assertEqual(self.dictionary.lookup('中'), ('zhōng', 'within; among; in'))
+        # Proper nouns without another reading keep their capitalized reading
+        self.assertEqual(self.dictionary.lookup('中国'), ('Zhōngguó', 'China'))
+
+    def test_uses_everyday_reading_of_polyphonic_characters(self):
+        self.assertEqual(self.dictionary.lookup('着')[0], 'zhe')
+        self.assertEqual(self.dictionary.lookup('得')[0], 'de')
+        self.assertEqual(self.dictionary.lookup('地')[0], 'dì')
+        self.assertEqual(self.dictionary.lookup('行')[0], 'xíng')
+        self.assertEqual(self.dictionary.lookup('银行')[0], 'yínháng')
+
+    def test_skips_variant_glosses_when_another_reading_exists(self):
+        self.assertEqual(self.dictionary.lookup('丢'), ('diū', 'to lose; to put aside'))
+        # A variant-only entry is still better than no entry
+        self.assertEqual(self.dictionary.lookup('为')[1], 'variant of 為|为[wei2]')
+
+    def test_annotates_and_picks_vocabulary(self):
+        self.assertEqual(self.dictionary.annotate('中国学生，2024'), 'Zhōngguó xuésheng 2024')
+        vocabulary = self.dictionary.vocabulary('中国学生去银行', exclude={'学生'})
+        self.assertEqual([v['word'] for v in vocabulary], ['中国', '银行'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import base64
+import importlib.util
+import unittest
+
+
+def has_module(name):
+    try:
+        return importlib.util.find_spec(name) is not None
+    except ModuleNotFoundError:
+        return False
+
+
+def part(mime_type, body, **extra):
+    data = base64.urlsafe_b64encode(body.encode('utf-8')).decode('ascii')
+    return dict({'mimeType': mime_type, 'body': {'data': data}}, **extra)
+
+
+@unittest.skipUnless(has_module('bs4'), 'beautifulsoup4 is required')
+class EmailDocumentTest(unittest.TestCase):
+    def test_keeps_html_part_when_plain_part_also_holds_html(self):
+        from src.document import EmailDocument
+
+        payload = {
+            'mimeType': 'multipart/alternative',
+            'headers': [{'name': 'Subject', 'value': 'News'}],
+            'parts': [
+                part('text/plain', '<html><body>Mislabelled copy</body></html>'),
+                part('text/html', '<html><body>Hi <a href="https://example.com/unsub">Unsubscribe</a></body></html>')
+            ]
+        }
+        document = EmailDocument.from_payload(payload)
+
+        self.assertIn(('https://example.com/unsub', 'Unsubscribe'), document.links)
+        self.assertIn('Mislabelled copy', document.text)
+        self.assertNotIn('<html', document.text)
+
+    def test_plain_part_holding_html_is_parsed_when_there_is_no_html_part(self):
+        from src.document import EmailDocument
+
+        payload = {
+            'mimeType': 'multipart/alternative',
+            'parts': [part('text/plain', '<html><body><a href="https://example.com/x">Read</a></body></html>')]
+        }
+        document = EmailDocument.from_payload(payload)
+
+        self.assertEqual(document.links, [('https://example.com/x', 'Read')])
+        self.assertEqual(document.text.strip(), 'Read')
+
+    def test_single_part_html_and_case_insensitive_headers(self):
+        from src.document import EmailDocument
+
+        payload = part('text/html', '<div><a href="https://example.com/opt-out">Opt out</a></div>', headers=[
+            {'name': 'subject', 'value': 'Weekly'},
+            {'name': 'List-unsubscribe', 'value': '<mailto:unsub@example.com>'}
+        ])
+        document = EmailDocument.from_payload(payload)
+
+        self.assertEqual(document.subject, 'Weekly')
+        self.assertEqual(document.list_unsubscribe, ['mailto:unsub@example.com'])
+        self.assertEqual(document.links, [('https://example.com/opt-out', 'Opt out')])
+
+
+if __name__ == '__main__':
+    unittest.main()
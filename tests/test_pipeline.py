@@ -0,0 +1,106 @@
+import threading
+import time
+import unittest
+
+from src.pipeline import Pipeline, Stage
+
+
+class PipelineTest(unittest.TestCase):
+    def run_pipeline(self, stages, source, **kwargs):
+        pipeline = Pipeline(stages, **kwargs)
+        runner = threading.Thread(target=pipeline.run, args=(source,), daemon=True)
+        runner.start()
+        runner.join(timeout=5)
+        self.assertFalse(runner.is_alive(), 'pipeline did not shut down')
+        return pipeline
+
+    def test_failing_item_does_not_stop_the_others(self):
+        results = []
+        errors = []
+        results_lock = threading.Lock()
+
+        def parse(item):
+            if item == 3:
+                raise ValueError('bad item')
+            return item * 10
+
+        def collect(item):
+            with results_lock:
+                results.append(item)
+            return item
+
+        pipeline = self.run_pipeline(
+            [Stage('parse', parse, workers=2), Stage('collect', collect)],
+            range(6),
+            on_error=lambda stage, item, error: errors.append((stage, item, str(error)))
+        )
+
+        self.assertEqual(sorted(results), [0, 10, 20, 40, 50])
+        self.assertEqual(errors, [('parse', 3, 'bad item')])
+        stats = pipeline.stats()
+        self.assertEqual(stats['parse']['failed'], 1)
+        self.assertEqual(stats['parse']['processed'], 5)
+        self.assertEqual(stats['collect']['processed'], 5)
+
+    def test_dropped_items_skip_later_stages(self):
+        seen = []
+        pipeline = self.run_pipeline(
+            [Stage('filter', lambda item: item if item % 2 else None), Stage('collect', seen.append)],
+            range(10)
+        )
+
+        self.assertEqual(sorted(seen), [1, 3, 5, 7, 9])
+        stats = pipeline.stats()
+        self.assertEqual(stats['filter']['dropped'], 5)
+        self.assertEqual(stats['filter']['processed'], 5)
+        # The last stage's return value is discarded; None counts as dropped there too
+        self.assertEqual(stats['collect']['dropped'], 5)
+
+    def test_shuts_down_with_uneven_worker_counts(self):
+        done = []
+        done_lock = threading.Lock()
+
+        def slow(item):
+            time.sleep(0.01)
+            return item
+
+        def finish(item):
+            with done_lock:
+                done.append(item)
+            return item
+
+        pipeline = self.run_pipeline(
+            [
+                Stage('fetch', slow, workers=4),
+                Stage('summarize', slow, workers=1),
+                Stage('forward', slow, workers=3),
+                Stage('label', finish, workers=2)
+            ],
+            range(20),
+            queue_size=2
+        )
+
+        self.assertEqual(sorted(done), list(range(20)))
+        stats = pipeline.stats()
+        self.assertTrue(all(stage['processed'] == 20 for stage in stats.values()))
+        self.assertLessEqual(max(stage['max_queue_depth'] for stage in stats.values()), 2)
+
+    def test_source_exception_stops_workers_and_propagates(self):
+        processed = []
+
+        def source():
+            yield 1
+            yield 2
+            raise RuntimeError('listing failed')
+
+        pipeline = Pipeline([Stage('fetch', lambda item: item, workers=3), Stage('collect', processed.append)])
+        with self.assertRaises(RuntimeError):
+            pipeline.run(source())
+
+        # Items already queued are finished and every worker thread has exited
+        self.assertEqual(sorted(processed), [1, 2])
+        self.assertFalse([t for t in threading.enumerate() if t.name.startswith(('fetch-', 'collect-'))])
+
+
+if __name__ == '__main__':
+    unittest.main()
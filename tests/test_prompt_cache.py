@@ -0,0 +1,111 @@
+import importlib.util
+import unittest
+
+from src.prompt_cache import LocalCacheBackend, PromptCache
+
+
+def has_module(name):
+    try:
+        return importlib.util.find_spec(name) is not None
+    except ModuleNotFoundError:
+        return False
+
+
+HAS_GENAI = has_module('google.generativeai')
+HAS_BS4 = has_module('bs4')
+
+INSTRUCTIONS = 'Summarize the email. ' * 50
+
+
+class PromptCacheTest(unittest.TestCase):
+    def make_cache(self, backend, **kwargs):
+        kwargs.setdefault('min_cache_tokens', 0)
+        return PromptCache('test-model', backend=backend, **kwargs)
+
+    def test_registers_instructions_once_per_key(self):
+        backend = LocalCacheBackend()
+        cache = self.make_cache(backend)
+
+        first = cache.model_for('summary', INSTRUCTIONS)
+        second = cache.model_for('summary', INSTRUCTIONS)
+        cache.model_for('translation', INSTRUCTIONS)
+
+        self.assertIs(first, second)
+        self.assertEqual(backend.created, ['summary', 'translation'])
+        self.assertEqual(backend.refreshed, [])
+
+    def test_refreshes_ttl_near_expiry(self):
+        backend = LocalCacheBackend()
+        # TTL inside the refresh margin, so every later use extends the cache
+        cache = self.make_cache(backend, ttl_seconds=1, refresh_margin_seconds=60)
+
+        cache.model_for('summary', INSTRUCTIONS)
+        cache.model_for('summary', INSTRUCTIONS)
+        cache.model_for('summary', INSTRUCTIONS)
+
+        self.assertEqual(backend.created, ['summary'])
+        self.assertEqual(backend.refreshed, ['summary', 'summary'])
+
+    def test_falls_back_to_system_instruction_when_caching_unsupported(self):
+        backend = LocalCacheBackend(supports_caching=False)
+        cache = self.make_cache(backend)
+
+        model = cache.model_for('summary', INSTRUCTIONS)
+        response = model.generate_content('Email Subject: hi')
+
+        self.assertEqual(backend.created, [])
+        self.assertFalse(model.cached)
+        self.assertEqual(response.usage_metadata.cached_content_token_count, 0)
+
+    def test_skips_cache_call_below_minimum_size(self):
+        backend = LocalCacheBackend()
+        cache = PromptCache('test-model', backend=backend, min_cache_tokens=1024)
+
+        model = cache.model_for('summary', 'Short instructions.')
+
+        self.assertEqual(backend.created, [])
+        self.assertFalse(model.cached)
+
+    def test_close_deletes_cached_contents_only(self):
+        backend = LocalCacheBackend()
+        cache = self.make_cache(backend, min_cache_tokens=10)
+        cache.model_for('summary', INSTRUCTIONS)
+        cache.model_for('short', 'Tiny.')
+
+        cache.close()
+
+        self.assertEqual(backend.deleted, ['summary'])
+        # A new run registers the instructions again
+        cache.model_for('summary', INSTRUCTIONS)
+        self.assertEqual(backend.created, ['summary', 'summary'])
+
+
+@unittest.skipUnless(HAS_GENAI and HAS_BS4, 'google-generativeai and beautifulsoup4 are required')
+class SummarizerPromptTest(unittest.TestCase):
+    def test_requests_carry_only_the_email_payload(self):
+        from src.summarizer import EmailSummarizer, SUMMARY_INSTRUCTIONS
+
+        backend = LocalCacheBackend(
+            responder=lambda instructions, prompt: '{"summary": "s", "action_required": false, "reason": "r"}')
+        summarizer = EmailSummarizer(
+            'test-key', prompt_cache=PromptCache('test-model', backend=backend, min_cache_tokens=0))
+
+        email = {'subject': 'Lunch?', 'sender': 'a@example.com', 'body': 'Are you free at noon?'}
+        summarizer.summarize(email)
+        summarizer.summarize(email)
+
+        self.assertEqual(backend.created, ['summary'])
+        self.assertEqual(len(backend.requests), 2)
+        for prompt in backend.requests:
+            self.assertIn('Email Subject: Lunch?', prompt)
+            self.assertIn('Are you free at noon?', prompt)
+            self.assertNotIn('Output ONLY the JSON object', prompt)
+        self.assertIn('Output ONLY the JSON object', SUMMARY_INSTRUCTIONS)
+
+        stats = summarizer.usage_stats()
+        self.assertEqual(stats['calls'], 2)
+        self.assertGreater(stats['cached_tokens'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()